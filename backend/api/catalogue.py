@@ -0,0 +1,87 @@
+import time
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from recipes.models import Ingredient, Tag
+from .serializers import IngredientSerializers, TagSerializers
+
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+
+class CatalogueIndex:
+    def __init__(self, items):
+        self.items = items
+        self.by_id = {item['id']: item for item in items}
+
+
+class IngredientIndex(CatalogueIndex):
+    '''Ингредиенты, отсортированные по названию в нижнем регистре:
+    совпадения с начала названия ищутся бинарным поиском.'''
+
+    def __init__(self, items):
+        super().__init__(items)
+        self.ordered = sorted(
+            items, key=lambda item: (item['name'].casefold(), item['id'])
+        )
+        self.names = [item['name'].casefold() for item in self.ordered]
+
+    def search(self, value, limit=INGREDIENT_SEARCH_LIMIT):
+        value = value.casefold()
+        start = bisect_left(self.names, value)
+        end = bisect_left(self.names, value + '\U0010ffff', start)
+        found = self.ordered[start:min(end, start + limit)]
+        if len(found) < limit:
+            found += [
+                item for name, item in zip(self.names, self.ordered)
+                if value in name and not name.startswith(value)
+            ][:limit - len(found)]
+        return found
+
+
+class Catalogue:
+    '''Справочник, который каждый процесс держит в памяти.
+
+    Версия справочника — время его последнего изменения — лежит в общем
+    кэше Django. Изменение справочника меняет версию, и процессы
+    перечитывают его из БД при следующем обращении.
+    '''
+
+    def __init__(self, name, load):
+        self.name = name
+        self.version_key = f'catalogue:{name}:version'
+        self.load = load
+        self.version = None
+        self.index = None
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, time.time(), None)
+            return cache.get(self.version_key)
+        return version
+
+    def get(self):
+        version = self.get_version()
+        if self.index is None or version != self.version:
+            self.index = self.load()
+            self.version = version
+        return self.index
+
+    def invalidate(self):
+        cache.set(self.version_key, time.time(), None)
+
+
+tags_catalogue = Catalogue(
+    'tags',
+    lambda: CatalogueIndex(
+        list(TagSerializers(Tag.objects.all(), many=True).data)
+    )
+)
+ingredients_catalogue = Catalogue(
+    'ingredients',
+    lambda: IngredientIndex(
+        list(IngredientSerializers(Ingredient.objects.all(), many=True).data)
+    )
+)
@@ -0,0 +1,51 @@
+import csv
+import json
+
+
+class Echo:
+    '''Файлоподобный объект для csv.writer, возвращающий записанную строку.'''
+    def write(self, value):
+        return value
+
+
+def shopping_cart_txt(ingredients):
+    yield 'Список покупок:\n'
+    for ingredient in ingredients:
+        yield (
+            f'\n• {ingredient["ingredient__name"]} '
+            f'({ingredient["ingredient__measurement_unit"]})'
+            f' - {ingredient["amount"]}'
+        )
+
+
+def shopping_cart_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['amount'],
+        ))
+
+
+def shopping_cart_json(ingredients):
+    separator = '['
+    for ingredient in ingredients:
+        yield separator + json.dumps(
+            {
+                'name': ingredient['ingredient__name'],
+                'measurement_unit': ingredient['ingredient__measurement_unit'],
+                'amount': ingredient['amount'],
+            },
+            ensure_ascii=False
+        )
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': (shopping_cart_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_cart_csv, 'text/csv; charset=utf-8'),
+    'json': (shopping_cart_json, 'application/json'),
+}
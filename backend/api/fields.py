@@ -0,0 +1,114 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import Field, ImageField
+from rest_framework.serializers import ListSerializer
+
+
+def check_image_size(size):
+    if size > settings.RECIPE_IMAGE_MAX_SIZE:
+        raise ValidationError(
+            f'Картинка больше {settings.RECIPE_IMAGE_MAX_SIZE} байт.'
+        )
+
+
+class LimitedImageField(ImageField):
+    '''Размер файла и габариты картинки проверяются по заголовку,
+    до того как Pillow прочитает картинку целиком.'''
+
+    def to_internal_value(self, data):
+        check_image_size(data.size)
+        try:
+            with Image.open(data) as image:
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            raise ValidationError(self.error_messages['invalid_image'])
+        finally:
+            data.seek(0)
+        limit = settings.RECIPE_IMAGE_MAX_DIMENSION
+        if max(width, height) > limit:
+            raise ValidationError(
+                f'Картинка больше {limit} пикселей по одной из сторон.'
+            )
+        return super().to_internal_value(data)
+
+
+class RecipeImageField(Base64ImageField, LimitedImageField):
+    '''Картинка рецепта base64-строкой в JSON или файлом
+    в multipart/form-data.'''
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return LimitedImageField.to_internal_value(self, data)
+        if isinstance(data, str):
+            # Размер декодированных данных известен заранее: строку,
+            # которая заведомо больше предела, незачем декодировать.
+            encoded = data.partition(';base64,')[2] or data
+            check_image_size(len(encoded) * 3 // 4)
+        return super().to_internal_value(data)
+
+
+def absolute_url(request, url):
+    if request is None:
+        return url
+    return request.build_absolute_uri(url)
+
+
+def variant_urls(variants, storage, request=None):
+    '''Ссылки на уменьшенные копии картинки по размерам;
+    ``None``, пока копии не построены.'''
+    kinds = {
+        kind: files for kind, files in variants.items()
+        if isinstance(files, dict)
+    }
+    if not kinds:
+        return None
+    return {
+        kind: {
+            key: value if key in ('width', 'height') else absolute_url(
+                request, storage.url(value)
+            )
+            for key, value in files.items()
+        }
+        for kind, files in kinds.items()
+    }
+
+
+class ImageVariantsField(Field):
+    '''Ссылки на уменьшенные копии картинки рецепта по размерам;
+    ``None``, пока копии не построены.'''
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image_variants')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        return variant_urls(
+            variants,
+            self.parent.Meta.model._meta.get_field('image').storage,
+            self.context.get('request')
+        )
+
+
+class SparseFieldsSerializerMixin:
+    '''Оставляет только поля из ``context['fields']``, если он задан.
+
+    Вложенные сериализаторы видят тот же контекст, поэтому поля
+    отбираются только у сериализатора верхнего уровня.
+    '''
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get('fields')
+        top = self.parent if isinstance(self.parent, ListSerializer) else self
+        if selected is None or top.parent is not None:
+            return fields
+        return OrderedDict(
+            (name, field) for name, field in fields.items()
+            if name in selected
+        )
@@ -1,28 +1,37 @@
+from django.db.models import Count, Exists, OuterRef
 from django_filters.rest_framework import (
     filters,
     FilterSet,
     ModelMultipleChoiceFilter
 )
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Recipe, Tag
 from users.models import User
 
 
-class IngredientSearchFilter(FilterSet):
-    name = filters.CharFilter(
-        lookup_expr='startswith'
-    )
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
+TAGS_MODE_ANY = 'any'
+TAGS_MODE_ALL = 'all'
+TAGS_MODES = (
+    (TAGS_MODE_ANY, 'Хотя бы один из тегов'),
+    (TAGS_MODE_ALL, 'Все теги'),
+)
+RECIPE_SORTS = {
+    'popular': ('-favorites_count', '-pub_date', '-id'),
+    'in_carts': ('-in_carts_count', '-pub_date', '-id'),
+    'trending': ('-trending_score', '-pub_date', '-id'),
+}
 
 
 class RecipeSearchFilter(FilterSet):
     tags = ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='tags_filter'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='tags_mode_filter'
     )
     is_favorited = filters.BooleanFilter(
         method='is_favorited_filter'
@@ -32,6 +41,40 @@ class RecipeSearchFilter(FilterSet):
     )
     name = filters.CharFilter()
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
+    sort = filters.ChoiceFilter(
+        choices=(
+            ('popular', 'Чаще добавляемые в избранное'),
+            ('in_carts', 'Чаще добавляемые в список покупок'),
+            ('trending', 'Популярные за последнее время'),
+        ),
+        method='sort_filter'
+    )
+
+    def sort_filter(self, queryset, name, value):
+        # Счётчики и рейтинг хранятся в самой таблице рецептов, поэтому
+        # сортировка идёт по индексу, без подсчёта избранного на каждый
+        # запрос.
+        return queryset.order_by(*RECIPE_SORTS[value])
+
+    def tags_filter(self, queryset, name, value):
+        # Подзапрос вместо JOIN по тегам: строки рецептов не размножаются,
+        # и DISTINCT не нужен при любом числе выбранных тегов.
+        tag_ids = [tag.pk for tag in value]
+        if not tag_ids:
+            return queryset
+        recipe_tags = Recipe.tags.through.objects.filter(tag__in=tag_ids)
+        if self.form.cleaned_data.get('tags_mode') == TAGS_MODE_ALL:
+            return queryset.filter(pk__in=recipe_tags.values(
+                'recipe'
+            ).annotate(
+                matched=Count('tag')
+            ).filter(matched=len(tag_ids)).values('recipe'))
+        return queryset.filter(
+            Exists(recipe_tags.filter(recipe=OuterRef('pk')))
+        )
+
+    def tags_mode_filter(self, queryset, name, value):
+        return queryset
 
     def is_favorited_filter(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
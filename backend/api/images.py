@@ -0,0 +1,180 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from recipes.models import Recipe
+from recipes.storage import delete_unused, touch
+from .middleware import invalidate_recipe
+
+
+logger = logging.getLogger(__name__)
+
+# Ошибки битой или слишком большой картинки: рецепт остаётся без копий.
+IMAGE_ERRORS = (OSError, UnidentifiedImageError, Image.DecompressionBombError)
+
+VARIANTS = {
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+VARIANTS_DIR = 'images/variants'
+WEBP_OPTIONS = {'quality': 80, 'method': 6}
+FALLBACK_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+}
+
+_executor = None
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def save_variant(image, source, kind, size, force=False):
+    '''Уменьшенная копия в WebP и в JPEG (PNG для прозрачных картинок)
+    без EXIF и прочих метаданных.'''
+    alpha = has_alpha(image)
+    variant = image.convert('RGBA' if alpha else 'RGB')
+    variant.thumbnail(size, Image.LANCZOS)
+    # Метаданные не переносятся, кроме цветового профиля.
+    icc_profile = image.info.get('icc_profile')
+    variant.info = {}
+    if icc_profile:
+        variant.info['icc_profile'] = icc_profile
+    fallback = 'PNG' if alpha else 'JPEG'
+    result = {'width': variant.width, 'height': variant.height}
+    for key, image_format, options in (
+        ('webp', 'WEBP', WEBP_OPTIONS),
+        (fallback.lower(), fallback, FALLBACK_OPTIONS[fallback]),
+    ):
+        name = variant_name(source, kind, key)
+        if force:
+            default_storage.delete(name)
+        elif touch(default_storage, name):
+            # Та же картинка у другого рецепта: копия уже построена.
+            result[key] = name
+            continue
+        if icc_profile:
+            options = {**options, 'icc_profile': icc_profile}
+        result[key] = default_storage.save(
+            name, ContentFile(encode(variant, image_format, **options))
+        )
+    return result
+
+
+def variant_name(source, kind, key):
+    '''Имя копии однозначно задаётся именем исходного файла.'''
+    stem = os.path.basename(source).replace('.', '-')
+    return f'{VARIANTS_DIR}/{stem}-{kind}.{key}'
+
+
+def variant_files(variants):
+    return [
+        name
+        for kind in VARIANTS
+        for key, name in variants.get(kind, {}).items()
+        if key not in ('width', 'height')
+    ]
+
+
+def release_image(name):
+    '''Удаляет файл картинки и его копии, если на него больше не ссылается
+    ни один рецепт.
+
+    Картинки хранятся по хешу содержимого и могут быть общими для
+    нескольких рецептов. Файлы, использованные за последние
+    ``UNUSED_MEDIA_MIN_AGE`` часов, остаются: их мог подхватить рецепт,
+    который ещё не сохранён. Их, как и копии, достроенные уже после
+    освобождения, собирает ``collect_media``.
+    '''
+    if not name or Recipe.objects.filter(image=name).exists():
+        return False
+    min_age = settings.UNUSED_MEDIA_MIN_AGE * 3600
+    storage = Recipe._meta.get_field('image').storage
+    if not delete_unused(storage, name, min_age):
+        return False
+    for kind in VARIANTS:
+        for key in ('webp', 'jpeg', 'png'):
+            delete_unused(
+                default_storage, variant_name(name, kind, key), min_age
+            )
+    return True
+
+
+def process_recipe_image(recipe_id, force=False):
+    '''Строит варианты картинки рецепта; ``True``, если они обновлены.
+
+    Варианты привязаны к имени исходного файла: пока картинка рецепта не
+    менялась, повторный вызов ничего не делает.
+    '''
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'image_variants'
+    ).first()
+    if recipe is None or not recipe.image:
+        return False
+    old = recipe.image_variants or {}
+    if not force and old.get('source') == recipe.image.name:
+        return False
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        variants = {'source': recipe.image.name}
+        for kind, size in VARIANTS.items():
+            variants[kind] = save_variant(
+                image, recipe.image.name, kind, size, force
+            )
+    # Пока шла обработка, картинку могли заменить: тогда варианты
+    # построит следующий вызов, а старые файлы освободит замена.
+    # updated_at сдвигается, чтобы сменились ETag и Last-Modified.
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=recipe.image.name
+    ).update(image_variants=variants, updated_at=timezone.now())
+    if updated:
+        invalidate_recipe(recipe_id)
+    return bool(updated)
+
+
+def run(recipe_id):
+    try:
+        process_recipe_image(recipe_id)
+    except IMAGE_ERRORS:
+        logger.exception(
+            'Не удалось обработать картинку рецепта %s', recipe_id
+        )
+    finally:
+        # Соединения с БД у потока свои, и закрыть их некому, кроме него.
+        connections.close_all()
+
+
+def schedule(recipe_id):
+    '''Обработка картинки в фоновом потоке, вне запроса.
+
+    При ``IMAGE_PROCESSING_WORKERS = 0`` выполняется сразу. Задачи,
+    потерянные при перезапуске процесса, подбирает команда
+    ``process_images``.
+    '''
+    global _executor
+    if not settings.IMAGE_PROCESSING_WORKERS:
+        process_recipe_image(recipe_id)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    _executor.submit(run, recipe_id)
@@ -0,0 +1,155 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .catalogue import ingredients_catalogue, tags_catalogue
+
+
+CACHED_ROUTES = {'recipe-list', 'recipe-detail'}
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Vary')
+LIST_VERSION_KEY = 'response-cache:recipes:version'
+HITS_KEY = 'response-cache:hits'
+MISSES_KEY = 'response-cache:misses'
+
+
+def recipe_version_key(pk):
+    return f'response-cache:recipe:{pk}:version'
+
+
+def invalidate_recipe_list():
+    cache.set(LIST_VERSION_KEY, time.time(), None)
+
+
+def invalidate_recipe(pk):
+    # Рецепт есть и в списках, поэтому вместе с его страницей
+    # сбрасываются и они.
+    cache.set_many({
+        recipe_version_key(pk): time.time(),
+        LIST_VERSION_KEY: time.time(),
+    }, None)
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        # Как и у справочников: версия, вытесненная из кэша, не должна
+        # вернуть ключи к значению, под которым лежат старые ответы.
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key) for key in keys]
+
+
+def count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats():
+    values = cache.get_many([HITS_KEY, MISSES_KEY])
+    return values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+class AnonymousRecipeCacheMiddleware:
+    '''Кэш готовых ответов списка и страницы рецепта для анонимов.
+
+    Для анонима флаги избранного, списка покупок и подписки всегда
+    ложны, так что ответ зависит только от рецептов и справочников.
+    Ключ — нормализованная строка запроса и версии списка рецептов
+    (или самого рецепта для его страницы), тегов и ингредиентов.
+    Изменение рецепта или справочника меняет версию, и старые ответы
+    больше не находятся. Всё остальное (счётчики, данные автора)
+    устаревает не дольше чем на ``RESPONSE_CACHE_TIMEOUT`` секунд.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return self.get_response(request)
+        cached = cache.get(key)
+        if cached is not None:
+            count(HITS_KEY)
+            return self.build_response(request, *cached)
+        count(MISSES_KEY)
+        response = self.get_response(request)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, (
+                response.content,
+                response['Content-Type'],
+                {
+                    header: response[header]
+                    for header in CACHED_HEADERS
+                    if response.has_header(header)
+                },
+            ), settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_key(self, request):
+        if (
+            not settings.RESPONSE_CACHE_TIMEOUT
+            or request.method not in ('GET', 'HEAD')
+            or 'HTTP_AUTHORIZATION' in request.META
+        ):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.url_name not in CACHED_ROUTES:
+            return None
+        path = request.path_info
+        if 'pk' in match.kwargs:
+            try:
+                pk = int(match.kwargs['pk'])
+            except ValueError:
+                return None
+            # /api/recipes/01/ и /api/recipes/1/ — одна и та же запись.
+            path = (match.url_name, pk)
+            version_keys = [recipe_version_key(pk)]
+        else:
+            version_keys = [LIST_VERSION_KEY]
+        query = sorted(
+            (name, sorted(values))
+            for name, values in request.GET.lists()
+        )
+        return 'response-cache:' + md5(repr((
+            path,
+            query,
+            request.META.get('HTTP_ACCEPT'),
+            get_versions(version_keys),
+            tags_catalogue.get_version(),
+            ingredients_catalogue.get_version(),
+        )).encode()).hexdigest()
+
+    def build_response(self, request, content, content_type, headers):
+        response = HttpResponse(content, content_type=content_type)
+        for header, value in headers.items():
+            response[header] = value
+        response['X-Cache'] = 'HIT'
+        last_modified = headers.get('Last-Modified')
+        return get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=last_modified and parse_http_date_safe(
+                last_modified
+            ),
+            response=response
+        )
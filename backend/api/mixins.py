@@ -1,4 +1,11 @@
+from datetime import datetime, timezone
+
+from django.views.decorators.http import condition
 from rest_framework import mixins, viewsets
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+
+from .serializers import BulkIdsSerializer
 
 
 class ListRetrieveCustomViewSet(
@@ -7,3 +14,150 @@ class ListRetrieveCustomViewSet(
     viewsets.GenericViewSet
 ):
     pass
+
+
+class ConditionalGetMixin:
+    '''Условный GET: если ETag или Last-Modified клиента актуальны,
+    сразу отвечает 304, не сериализуя данные.'''
+
+    def get_etag(self, request, *args, **kwargs):
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return None
+
+    def conditional(self, view, request, *args, **kwargs):
+        return condition(
+            etag_func=self.get_etag,
+            last_modified_func=self.get_last_modified
+        )(view)(request, *args, **kwargs)
+
+
+class ReaderMixin:
+    '''На GET данные собирает ``reader_class``, если он задан, в обход
+    сериализаторов DRF; ``None`` оставляет обычный сериализатор.'''
+    reader_class = None
+
+    def uses_reader(self):
+        return self.reader_class is not None and self.request.method == 'GET'
+
+    def get_serializer(self, *args, **kwargs):
+        if not self.uses_reader():
+            return super().get_serializer(*args, **kwargs)
+        kwargs.setdefault('context', self.get_serializer_context())
+        return self.reader_class(*args, **kwargs)
+
+
+class SparseFieldsMixin:
+    '''Поля ответа на GET по ``?fields=`` (только перечисленные через
+    запятую) и ``?omit=`` (все, кроме перечисленных).
+
+    Допустимые имена возвращает ``get_sparse_fields``. Выбранные поля
+    попадают в контекст сериализатора (``fields``), а представление по
+    ним же сужает выборку из БД.
+    '''
+    fields_query_param = 'fields'
+    omit_query_param = 'omit'
+
+    def get_sparse_fields(self):
+        return ()
+
+    def get_requested_fields(self):
+        '''Выбранные поля в порядке ответа; ``None`` — все поля.'''
+        if not hasattr(self, 'requested_fields'):
+            self.requested_fields = self.parse_requested_fields()
+        return self.requested_fields
+
+    def parse_requested_fields(self):
+        params = self.request.query_params
+        if self.request.method != 'GET' or not (
+            params.get(self.fields_query_param)
+            or params.get(self.omit_query_param)
+        ):
+            return None
+        available = self.get_sparse_fields()
+        names = {}
+        for param in (self.fields_query_param, self.omit_query_param):
+            names[param] = {
+                name.strip()
+                for name in params.get(param, '').split(',')
+                if name.strip()
+            }
+            unknown = names[param] - set(available)
+            if unknown:
+                raise ValidationError({param: (
+                    'Неизвестные поля: ' + ', '.join(sorted(unknown))
+                )})
+        included = names[self.fields_query_param] or set(available)
+        fields = tuple(
+            name for name in available
+            if name in included and name not in names[self.omit_query_param]
+        )
+        if not fields:
+            raise ValidationError({
+                self.omit_query_param: 'Не осталось ни одного поля.'
+            })
+        return fields
+
+    def select_fields(self, names):
+        '''Те из ``names``, что попадут в ответ.'''
+        fields = self.get_requested_fields()
+        return [name for name in names if fields is None or name in fields]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+
+class CatalogueViewSet(ConditionalGetMixin, ListRetrieveCustomViewSet):
+    '''Отдаёт справочник из памяти процесса, не обращаясь к БД.'''
+    catalogue = None
+
+    def get_etag(self, request, *args, **kwargs):
+        return f'{self.catalogue.name}-{self.catalogue.get_version()}'
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return datetime.fromtimestamp(
+            self.catalogue.get_version(), tz=timezone.utc
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.list_catalogue, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            self.retrieve_catalogue, request, *args, **kwargs
+        )
+
+    def list_catalogue(self, request, *args, **kwargs):
+        return Response(self.catalogue.get().items)
+
+    def retrieve_catalogue(self, request, *args, **kwargs):
+        try:
+            return Response(
+                self.catalogue.get().by_id[int(kwargs[self.lookup_field])]
+            )
+        except (KeyError, ValueError):
+            raise NotFound
+
+
+class BulkActionMixin:
+    '''Пакетные действия над списком ``ids`` из тела запроса.
+
+    Ответ перечисляет результат для каждого id; id, не найденные
+    в базе, получают статус ``not_found``. Найденные записи представление
+    блокирует от удаления до конца записи (``select_for_update``), иначе
+    удалённая посреди запроса запись получила бы статус найденной.
+    '''
+
+    def get_bulk_ids(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['ids']
+
+    def bulk_response(self, ids, statuses):
+        return Response({'results': [
+            {'id': pk, 'status': statuses.get(pk, 'not_found')}
+            for pk in ids
+        ]})
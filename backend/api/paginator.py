@@ -1,6 +1,293 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    '''Оценка числа строк планировщиком PostgreSQL.'''
+    with connections[queryset.db].cursor() as cursor:
+        if not queryset.query.where and not queryset.query.distinct:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+            if row is not None and row[0] >= 0:
+                return row[0]
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def count_rows(queryset, version=()):
+    '''Число записей выборки и признак того, что оно точное.
+
+    Результат кешируется по SQL выборки без сортировки, аннотаций
+    и списка столбцов: от них число строк не зависит, так что одинаковые
+    фильтры делят одно значение у всех пользователей и вариантов
+    ``?fields=``; остаются только условия WHERE, в том числе зависящие
+    от пользователя. ``version`` входит в ключ кэша, ``None`` отключает
+    кэш. Если планировщик PostgreSQL оценивает выборку больше
+    ``PAGINATION_COUNT_ESTIMATE_THRESHOLD``, вместо ``COUNT(*)``
+    возвращается оценка.
+    '''
+    queryset = queryset.order_by().values('pk').prefetch_related(None)
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, True
+    key = 'count-' + md5(
+        repr((queryset.db, sql, params, version)).encode()
+    ).hexdigest()
+    result = None if version is None else cache.get(key)
+    if result is not None:
+        return result
+    threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+    if threshold and connections[queryset.db].vendor == 'postgresql':
+        estimate = estimate_count(queryset)
+        if estimate > threshold:
+            result = (estimate, False)
+    if result is None:
+        result = (queryset.count(), True)
+    if version is not None:
+        cache.set(key, result, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return result
+
+
+def count_version(view):
+    '''Версия кэша числа записей для представления: его метод
+    ``get_count_version`` или ``()``.'''
+    get_version = getattr(view, 'get_count_version', None)
+    return () if get_version is None else get_version()
+
+
+class LookaheadPage(Page):
+    '''Страница, о следующей странице которой известно по лишней
+    выбранной строке, а не по общему числу записей.'''
+
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class CachedCountPaginator(DjangoPaginator):
+    '''Страницы строятся без общего числа записей: оно может быть
+    оценкой или значением из кэша и годится только для поля ``count``.
+
+    Страница выбирается с одной лишней строкой, по которой видно, есть
+    ли следующая.
+    '''
+    count_is_exact = True
+
+    def __init__(self, object_list, per_page, version=(), **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.version = version
+
+    @cached_property
+    def count(self):
+        count, self.count_is_exact = count_rows(
+            self.object_list, self.version
+        )
+        return count
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        return LookaheadPage(
+            rows[:self.per_page], number, self, len(rows) > self.per_page
+        )
+
+
+class KeysetPagination(BasePagination):
+    '''Постраничный вывод по ключу сортировки вместо OFFSET.
+
+    Курсор хранит значения полей сортировки последней (или первой)
+    записи страницы, следующая страница выбирается условием
+    ``(pub_date, id) < (курсор)``, поэтому глубина страницы не влияет
+    на стоимость запроса, а новые записи не сдвигают уже выданные.
+    '''
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-pub_date', '-id')
+    count_by_default = True
+
+    def __init__(self, ordering=None, page_size=None, count=None):
+        if ordering is not None:
+            self.ordering = ordering
+        if page_size is not None:
+            self.page_size = page_size
+        if count is not None:
+            self.count_by_default = count
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip('-'))
+            for name in self.ordering
+        ]
+        values, reverse = self.decode_cursor(request)
+        self.count = None
+        if self.wants_count(request):
+            self.count, self.count_is_exact = count_rows(
+                queryset, count_version(view)
+            )
+        queryset = queryset.order_by(*self.get_ordering(reverse))
+        if values is not None:
+            queryset = queryset.filter(self.after(values, reverse))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+        self.next = self.previous = None
+        if results and (has_more if not reverse else values is not None):
+            self.next = self.encode_cursor(results[-1], False)
+        if results and (has_more if reverse else values is not None):
+            self.previous = self.encode_cursor(results[0], True)
+        return results
+
+    def wants_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.count_by_default
+        return value not in ('0', 'false')
+
+    def get_ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return [
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        ]
+
+    def after(self, values, reverse):
+        '''Условие «строго после курсора» для составного ключа.'''
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.get_ordering(reverse), values):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, item, reverse):
+        position = [reverse] + [
+            field.value_to_string(item) for field in self.fields
+        ]
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(position).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor
+        )
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            reverse, *values = json.loads(base64.urlsafe_b64decode(cursor))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [
+                field.to_python(value)
+                for field, value in zip(self.fields, values)
+            ], bool(reverse)
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise NotFound('Неверный курсор.')
+
+    def get_paginated_response(self, data):
+        pairs = [
+            ('next', self.next),
+            ('previous', self.previous),
+            ('results', data),
+        ]
+        if self.count is not None:
+            pairs[:0] = [
+                ('count', self.count),
+                ('count_is_exact', self.count_is_exact),
+            ]
+        return Response(OrderedDict(pairs))
 
 
 class CustomPaginator(PageNumberPagination):
+    '''Номера страниц, а с параметром ``cursor`` — постраничный вывод
+    по ключу для представлений, задающих ``cursor_ordering``.
+
+    Общее число записей берётся из :func:`count_rows`, ответ сообщает
+    в ``count_is_exact``, точное ли оно.
+    '''
     page_size_query_param = "limit"
     page_size = 6
+    keyset = None
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(queryset, page_size, self.version)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.version = count_version(view)
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering is not None and queryset.query.order_by:
+            # Явная сортировка (например, ?sort=popular) сама служит ключом.
+            ordering = tuple(queryset.query.order_by)
+        if ordering is None or (
+            KeysetPagination.cursor_query_param not in request.query_params
+        ):
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination(
+            ordering, self.get_page_size(request)
+        )
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_is_exact', self.page.paginator.count_is_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
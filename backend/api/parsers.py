@@ -0,0 +1,67 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+# Запас на поле ``data`` и служебные части multipart сверх самой картинки.
+FIELDS_MAX_SIZE = 1024 * 1024
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой файл.'
+    default_code = 'payload_too_large'
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    '''Пишет файл на диск по частям, не держа его в памяти, и прерывает
+    загрузку, как только он превысит ``RECIPE_IMAGE_MAX_SIZE``.'''
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise PayloadTooLarge(
+                f'Картинка больше {settings.RECIPE_IMAGE_MAX_SIZE} байт.'
+            )
+        return super().receive_data_chunk(raw_data, start)
+
+
+class MultiPartData(dict):
+    '''Поля из JSON. DRF добавляет к ним файлы через update(), и из
+    MultiValueDict должен попасть последний файл, а не список.'''
+
+    def copy(self):
+        return type(self)(self)
+
+    def update(self, other):
+        if isinstance(other, MultiValueDict):
+            other = other.dict()
+        super().update(other)
+
+
+class RecipeMultiPartParser(MultiPartParser):
+    '''multipart/form-data для рецепта: картинка — файлом в части
+    ``image``, остальные поля — JSON-объектом в части ``data``.'''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if length > settings.RECIPE_IMAGE_MAX_SIZE + FIELDS_MAX_SIZE:
+            raise PayloadTooLarge()
+        request.upload_handlers = [
+            LimitedTemporaryFileUploadHandler(request._request)
+        ]
+        result = super().parse(stream, media_type, parser_context)
+        if 'data' not in result.data:
+            return result
+        try:
+            data = json.loads(result.data['data'])
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            raise ParseError('Часть data должна содержать JSON-объект.')
+        return DataAndFiles(MultiPartData(data), result.files)
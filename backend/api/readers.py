@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from rest_framework.fields import DateTimeField
+
+from recipes.models import Recipe, RecipeIngredients, Tag
+from users.models import User
+from .fields import absolute_url, variant_urls
+
+
+RECIPE_FIELDS = (
+    'id', 'author', 'tags', 'ingredients', 'is_favorited',
+    'is_in_shopping_cart', 'images', 'name', 'image', 'text',
+    'cooking_time', 'pub_date',
+)
+# Поля ответа, которые читаются из других столбцов или не из строки
+# рецепта вовсе.
+RECIPE_COLUMNS = {
+    'tags': (),
+    'ingredients': (),
+    'is_favorited': (),
+    'is_in_shopping_cart': (),
+    'images': ('image_variants',),
+}
+AUTHOR_FIELDS = (
+    'email', 'id', 'username', 'first_name', 'last_name', 'is_subscribed',
+)
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit', 'amount')
+
+datetime_field = DateTimeField()
+
+
+def recipe_columns(fields):
+    '''Столбцы рецепта, нужные для полей ответа ``fields``.'''
+    return [
+        column
+        for name in fields
+        for column in RECIPE_COLUMNS.get(name, (name,))
+    ]
+
+
+class RecipeReader:
+    '''Тот же JSON, что у ``RecipeSerializer``, без полей DRF.
+
+    Рецепты должны быть выбраны через ``with_user_flags``. Теги,
+    ингредиенты и авторы всей страницы читаются тремя запросами
+    ``values_list`` и собираются в словари напрямую: на каждый объект
+    не создаются ни сериализаторы, ни поля. Совпадение ответа
+    с ``RecipeSerializer`` проверяют тесты.
+
+    ``context['fields']`` ограничивает ответ перечисленными полями;
+    связи, которых среди них нет, не запрашиваются.
+    '''
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.storage = Recipe._meta.get_field('image').storage
+
+    @property
+    def data(self):
+        recipes = list(self.instance) if self.many else [self.instance]
+        data = self.read(recipes)
+        return data if self.many else data[0]
+
+    def read(self, recipes):
+        if not recipes:
+            return []
+        fields = self.context.get('fields') or RECIPE_FIELDS
+        ids = [recipe.pk for recipe in recipes]
+        self.related = {}
+        if 'tags' in fields:
+            self.related['tags'] = self.tags(ids)
+        if 'ingredients' in fields:
+            self.related['ingredients'] = self.ingredients(ids)
+        if 'author' in fields:
+            self.related['author'] = self.authors(
+                {recipe.author_id for recipe in recipes}
+            )
+        getters = [
+            (name, getattr(self, f'get_{name}', None)) for name in fields
+        ]
+        return [
+            {
+                name: getter(recipe) if getter else getattr(recipe, name)
+                for name, getter in getters
+            }
+            for recipe in recipes
+        ]
+
+    def get_author(self, recipe):
+        return self.related['author'][recipe.author_id]
+
+    def get_tags(self, recipe):
+        return self.related['tags'][recipe.pk]
+
+    def get_ingredients(self, recipe):
+        return self.related['ingredients'][recipe.pk]
+
+    def get_images(self, recipe):
+        return variant_urls(recipe.image_variants, self.storage, self.request)
+
+    def get_image(self, recipe):
+        if not recipe.image:
+            return None
+        return absolute_url(self.request, recipe.image.url)
+
+    def get_pub_date(self, recipe):
+        return datetime_field.to_representation(recipe.pub_date)
+
+    @staticmethod
+    def tags(ids):
+        tags = defaultdict(list)
+        rows = Tag.objects.filter(recipe__in=ids).values_list(
+            'recipe', *TAG_FIELDS
+        )
+        for recipe_id, *values in rows:
+            tags[recipe_id].append(dict(zip(TAG_FIELDS, values)))
+        return tags
+
+    @staticmethod
+    def ingredients(ids):
+        ingredients = defaultdict(list)
+        rows = RecipeIngredients.objects.filter(recipe__in=ids).values_list(
+            'recipe', 'ingredient', 'ingredient__name',
+            'ingredient__measurement_unit', 'amount'
+        ).order_by('pk')
+        for recipe_id, *values in rows:
+            ingredients[recipe_id].append(
+                dict(zip(INGREDIENT_FIELDS, values))
+            )
+        return ingredients
+
+    def authors(self, ids):
+        rows = User.objects.with_is_subscribed(self.request.user).filter(
+            pk__in=ids
+        ).values_list(*AUTHOR_FIELDS)
+        return {
+            values[1]: dict(zip(AUTHOR_FIELDS, values)) for values in rows
+        }
@@ -1,10 +1,15 @@
+import logging
+
 from django.core.exceptions import ValidationError
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
 from rest_framework.serializers import (
     CharField,
     CurrentUserDefault,
+    IntegerField,
+    ListField,
     ModelSerializer,
     PrimaryKeyRelatedField,
+    Serializer,
     SerializerMethodField
 )
 
@@ -14,9 +19,20 @@ from recipes.models import (
     Recipe,
     RecipeIngredients,
     ShoppingCart,
+    ShoppingListItem,
     Tag
 )
 from users.serializers import CustomUserSerializer
+from .fields import (
+    ImageVariantsField,
+    RecipeImageField,
+    SparseFieldsSerializerMixin
+)
+
+
+logger = logging.getLogger(__name__)
+
+BULK_IDS_LIMIT = 100
 
 
 class TagSerializers(ModelSerializer):
@@ -50,7 +66,7 @@ class IngredientInRecipeSerializer(ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
-class RecipeSerializer(ModelSerializer):
+class RecipeSerializer(SparseFieldsSerializerMixin, ModelSerializer):
     author = CustomUserSerializer()
     tags = TagSerializers(many=True, read_only=True)
     ingredients = IngredientInRecipeSerializer(
@@ -60,8 +76,11 @@ class RecipeSerializer(ModelSerializer):
     )
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
+    images = ImageVariantsField()
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if (
             request.user.is_authenticated
@@ -74,6 +93,8 @@ class RecipeSerializer(ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if (
             request.user.is_authenticated
@@ -87,7 +108,12 @@ class RecipeSerializer(ModelSerializer):
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        # Служебные столбцы (счётчики, рейтинг, дата изменения) в ответ
+        # не входят: от них не зависят ни ETag, ни Last-Modified.
+        exclude = (
+            'image_variants', 'updated_at', 'favorites_count',
+            'in_carts_count', 'trending_score',
+        )
 
 
 class RecipeCreateSerializer(ModelSerializer):
@@ -104,7 +130,7 @@ class RecipeCreateSerializer(ModelSerializer):
         many=True,
 
     )
-    image = Base64ImageField(
+    image = RecipeImageField(
         required=False,
         allow_null=True,
     )
@@ -113,9 +139,12 @@ class RecipeCreateSerializer(ModelSerializer):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('RecipeIngredients')
-        recipe = Recipe.objects.create(**validated_data, author=author)
-        recipe.tags.add(*tags)
-        self.save_ingredients(recipe, ingredients)
+        # Сброс кэша ответов ждёт коммита: до него рецепт без тегов
+        # и ингредиентов не должен попасть в кэш.
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data, author=author)
+            recipe.tags.add(*tags)
+            self.save_ingredients(recipe, ingredients)
         return recipe
 
     def update(self, instance, validated_data):
@@ -128,14 +157,61 @@ class RecipeCreateSerializer(ModelSerializer):
         )
         ingredients = validated_data.pop('RecipeIngredients')
         tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.add(*tags)
-        instance.ingredients.clear()
-        recipe = instance
-        self.save_ingredients(recipe, ingredients)
-        instance.save()
+        with transaction.atomic():
+            instance.tags.set(tags)
+            old_amounts, new_amounts = self.update_ingredients(
+                instance, ingredients
+            )
+            instance.save()
+            ShoppingListItem.objects.change_recipe(
+                instance.id, old_amounts, new_amounts
+            )
         return instance
 
+    def update_ingredients(self, recipe, ingredients):
+        '''Применяет к рецепту только разницу в ингредиентах.
+
+        Число добавленных, удалённых и изменённых строк пишется в лог
+        на уровне DEBUG.
+        '''
+        current = {
+            row.ingredient_id: row
+            for row in RecipeIngredients.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in current.items()
+        }
+        new_amounts = {
+            ingredient['ingredient']['id'].pk: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - new_amounts.keys()
+        added = [
+            RecipeIngredients(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        ]
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = new_amounts.get(ingredient_id, row.amount)
+            if amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            RecipeIngredients.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        RecipeIngredients.objects.bulk_create(added)
+        RecipeIngredients.objects.bulk_update(changed, ['amount'])
+        logger.debug(
+            'Рецепт %s: изменено строк ингредиентов: %s', recipe.pk,
+            len(removed) + len(added) + len(changed)
+        )
+        return old_amounts, new_amounts
+
     @staticmethod
     def save_ingredients(recipe, ingredients):
         ingredients_list = []
@@ -189,76 +265,21 @@ class RecipeCreateSerializer(ModelSerializer):
         fields = '__all__'
 
 
-class FavoriteSerializer(ModelSerializer):
-    user = PrimaryKeyRelatedField(
-        read_only=True, default=CurrentUserDefault())
-    recipe = PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all(),
-        write_only=True,
-    )
-
-    def create(self, validated_data):
-        return Favorite.objects.create(
-            user=self.context.get('request').user, **validated_data)
-
-    def validate(self, data):
-        object = Favorite.objects.filter(
-            recipe=data['recipe'],
-            user=self.context['request'].user
-        )
-        if self.context['request'].method == 'DELETE':
-            raise ValidationError(
-                'этот рецепт не был добавлен в избранное'
-            )
-        if self.context['request'].method == 'POST' and object.exists():
-            raise ValidationError(
-                'этот рецепт уже был добавлен в избранное'
-            )
-
-        return data
-
-    class Meta:
-        model = Favorite
-        fields = ('recipe', 'user',)
-
-
 class RecipeLightSerializer(ModelSerializer):
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
-class ShoppingCartSerializer(ModelSerializer):
-    user = PrimaryKeyRelatedField(
-        read_only=True, default=CurrentUserDefault()
-    )
-    recipe = PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all(),
-        write_only=True,
+class BulkIdsSerializer(Serializer):
+    '''Список id для пакетных операций, повторы отбрасываются.'''
+    ids = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_IDS_LIMIT
     )
 
-    def create(self, validated_data):
-        return ShoppingCart.objects.create(
-            user=self.context.get('request').user,
-            **validated_data
-        )
-
-    def validate(self, data):
-        object = ShoppingCart.objects.filter(
-            recipe=data['recipe'],
-            user=self.context['request'].user
-        )
-        if self.context['request'].method == 'DELETE':
-            raise ValidationError(
-                'этот рецепт не был добавлен в список покупок'
-            )
-        if self.context['request'].method == 'POST' and object.exists():
-            raise ValidationError(
-                'этот рецепт уже был добавлен в список покупок'
-            )
-
-        return data
-
-    class Meta:
-        model = ShoppingCart
-        fields = ('recipe', 'user',)
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, Tag
+from .catalogue import ingredients_catalogue, tags_catalogue
+from .images import release_image, schedule
+from .middleware import invalidate_recipe
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    transaction.on_commit(tags_catalogue.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    transaction.on_commit(ingredients_catalogue.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_responses(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_recipe(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_processing(sender, instance, **kwargs):
+    # Варианты строятся после коммита, вне запроса; если картинка не
+    # менялась, обработка сразу завершается.
+    if instance.image and (
+        instance.image_variants.get('source') != instance.image.name
+    ):
+        transaction.on_commit(lambda: schedule(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    old = getattr(instance, 'loaded_image', None)
+    if old and old != instance.image.name:
+        transaction.on_commit(lambda: release_image(old))
+    instance.loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    name = instance.image.name
+    transaction.on_commit(lambda: release_image(name))
@@ -1,54 +1,164 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from datetime import datetime, timezone
+from hashlib import md5
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, JSONParser
 from rest_framework.response import Response
 
-from .filters import IngredientSearchFilter, RecipeSearchFilter
-from .mixins import ListRetrieveCustomViewSet
+from .catalogue import ingredients_catalogue, tags_catalogue
+from .exports import SHOPPING_CART_FORMATS
+from .filters import RecipeSearchFilter
+from .middleware import LIST_VERSION_KEY, get_versions
+from .mixins import (
+    BulkActionMixin,
+    CatalogueViewSet,
+    ConditionalGetMixin,
+    ReaderMixin,
+    SparseFieldsMixin
+)
+from .paginator import KeysetPagination
+from .parsers import RecipeMultiPartParser
 from .permissions import IsAuthorOrAdminOrReadOnly
+from .readers import RECIPE_FIELDS, RecipeReader, recipe_columns
 from .serializers import (
-    FavoriteSerializer,
     IngredientSerializers,
     RecipeCreateSerializer,
     RecipeSerializer,
     RecipeLightSerializer,
-    ShoppingCartSerializer,
     TagSerializers
 )
 from recipes.models import (
+    USER_FLAGS,
     Favorite,
     Ingredient,
     Recipe,
-    RecipeIngredients,
     ShoppingCart,
+    ShoppingListItem,
     Tag
 )
 
 
-class TagViewSet(ListRetrieveCustomViewSet):
+class TagViewSet(CatalogueViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializers
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
+    catalogue = tags_catalogue
 
 
-class IngredientViewSet(ListRetrieveCustomViewSet):
+class IngredientViewSet(CatalogueViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializers
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientSearchFilter
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
+    catalogue = ingredients_catalogue
+
+    def list_catalogue(self, request, *args, **kwargs):
+        name = request.query_params.get('name', '').strip()
+        if name:
+            return Response(self.catalogue.get().search(name))
+        return super().list_catalogue(request, *args, **kwargs)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ConditionalGetMixin, SparseFieldsMixin, ReaderMixin, BulkActionMixin,
+    viewsets.ModelViewSet
+):
     queryset = Recipe.objects.all()
+    reader_class = RecipeReader
     permission_classes = [IsAuthorOrAdminOrReadOnly, ]
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeSearchFilter
+    parser_classes = (JSONParser, FormParser, RecipeMultiPartParser)
+    cursor_ordering = ('-pub_date', '-id')
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+
+    def get_count_version(self):
+        # Избранное, список покупок и ленту меняют записи, не трогающие
+        # версию списка рецептов, поэтому их число записей не кешируется.
+        params = self.request.query_params
+        if self.action == 'feed' or not self.request.user.is_anonymous and (
+            any(params.get(name) for name in self.user_filters)
+        ):
+            return None
+        return get_versions([LIST_VERSION_KEY])
+
+    def get_version(self, request, pk):
+        if not hasattr(self, 'version'):
+            try:
+                self.version = Recipe.objects.filter(pk=pk).versions(
+                    request.user
+                ).first()
+            except (ValueError, TypeError):
+                # Неверный id: 404 ответит get_object_or_404.
+                self.version = None
+        return self.version
+
+    def get_etag(self, request, *args, **kwargs):
+        version = self.get_version(request, kwargs['pk'])
+        if version is None:
+            return None
+        return md5(repr((
+            request.user.pk,
+            version,
+            tags_catalogue.get_version(),
+            ingredients_catalogue.get_version(),
+        )).encode()).hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        # Для пользователя ответ зависит ещё и от его избранного и подписок,
+        # поэтому дата изменения отдаётся только анонимам.
+        version = self.get_version(request, kwargs['pk'])
+        if version is None or not request.user.is_anonymous:
+            return None
+        return max(
+            version[1],
+            datetime.fromtimestamp(
+                max(
+                    tags_catalogue.get_version(),
+                    ingredients_catalogue.get_version()
+                ),
+                tz=timezone.utc
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.conditional(super().retrieve, request, *args, **kwargs)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def get_sparse_fields(self):
+        return RECIPE_FIELDS
+
+    def get_queryset(self):
+        if self.uses_reader():
+            # Связанные данные читатель выбирает сам.
+            return Recipe.objects.with_user_flags(
+                self.request.user, self.select_fields(USER_FLAGS)
+            )
+        if self.request.method == 'GET':
+            return Recipe.objects.for_read(
+                self.request.user, self.get_requested_fields()
+            )
+        return super().get_queryset()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_requested_fields()
+        if fields is None:
+            return queryset
+        # Поля сортировки нужны курсору постраничного вывода.
+        ordering = queryset.query.order_by or self.cursor_ordering
+        return queryset.only(
+            *recipe_columns(fields),
+            *(name.lstrip('-') for name in ordering)
+        )
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -57,28 +167,26 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeLightSerializer
         return RecipeCreateSerializer
 
-    def post_and_delete_recipe_to(
-        self, request, model, serializer, pk
-    ):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        data = request.data.copy()
-        data.update({'recipe': recipe.id})
-
-        serializer = serializer(
-            data=data,
-            context={'request': request}
-        )
-
-        object = model.objects.filter(
-            recipe=recipe, user=request.user
+    def post_and_delete_recipe_to(self, request, model, pk, errors):
+        if request.method == 'DELETE':
+            if model.objects.remove_recipe(request.user.id, pk):
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(Recipe, pk=pk)
+            return Response(
+                {'errors': errors['DELETE']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        recipe = get_object_or_404(
+            Recipe.objects.only(
+                'id', 'name', 'image', 'image_variants', 'cooking_time'
+            ),
+            pk=pk
         )
-
-        if request.method == "DELETE" and object.exists():
-            object.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        if not model.objects.add_recipe(request.user.id, recipe.id):
+            return Response(
+                {'errors': errors['POST']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(
             status=status.HTTP_201_CREATED,
             data=self.get_serializer(recipe).data
@@ -86,49 +194,114 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(["POST", "DELETE"], detail=True)
     def favorite(self, request, **kwargs):
-        pk = kwargs['pk']
         return self.post_and_delete_recipe_to(
             request,
             Favorite,
-            FavoriteSerializer,
-            pk
+            kwargs['pk'],
+            {
+                'POST': 'этот рецепт уже был добавлен в избранное',
+                'DELETE': 'этот рецепт не был добавлен в избранное',
+            }
         )
 
     @action(["POST", "DELETE"], detail=True)
     def shopping_cart(self, request, **kwargs):
-        pk = kwargs['pk']
         return self.post_and_delete_recipe_to(
             request,
             ShoppingCart,
-            ShoppingCartSerializer,
-            pk
+            kwargs['pk'],
+            {
+                'POST': 'этот рецепт уже был добавлен в список покупок',
+                'DELETE': 'этот рецепт не был добавлен в список покупок',
+            }
+        )
+
+    @transaction.atomic
+    def bulk_post_and_delete_recipes_to(self, request, model):
+        ids = self.get_bulk_ids(request)
+        # Найденные рецепты нельзя удалить до конца транзакции, так что
+        # not_found получают ровно отсутствующие id. Добавлять их
+        # в избранное и списки другим пользователям блокировка не мешает,
+        # а счётчики этих строк транзакция всё равно обновляет.
+        found = list(
+            Recipe.objects.filter(pk__in=ids).select_for_update(
+                no_key=True
+            ).order_by('pk').values_list('pk', flat=True)
+        )
+        if request.method == 'DELETE':
+            done = model.objects.remove_recipes(request.user.id, found)
+            statuses = dict.fromkeys(found, 'absent')
+            statuses.update(dict.fromkeys(done, 'removed'))
+        else:
+            done = model.objects.add_recipes(request.user.id, found)
+            statuses = dict.fromkeys(found, 'exists')
+            statuses.update(dict.fromkeys(done, 'added'))
+        return self.bulk_response(ids, statuses)
+
+    @action(
+        ["POST", "DELETE"], detail=False,
+        url_path='favorite', url_name='favorite-bulk'
+    )
+    def favorite_bulk(self, request):
+        return self.bulk_post_and_delete_recipes_to(request, Favorite)
+
+    @action(
+        ["POST", "DELETE"], detail=False,
+        url_path='shopping_cart', url_name='shopping-cart-bulk'
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_post_and_delete_recipes_to(request, ShoppingCart)
+
+    @action(
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated, ]
+    )
+    def feed(self, request):
+        # Лента всегда листается по курсору; общее число записей —
+        # только по ?count=true, иначе пришлось бы считать всю ленту.
+        queryset = self.filter_queryset(
+            self.get_queryset().feed_of(request.user)
+        )
+        paginator = KeysetPagination(
+            tuple(queryset.query.order_by) or self.cursor_ordering,
+            self.paginator.get_page_size(request),
+            count=False
         )
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(
         detail=False,
         permission_classes=[permissions.IsAuthenticated, ]
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = RecipeIngredients.objects.filter(
-            recipe__shopping_list__user=user
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in SHOPPING_CART_FORMATS:
+            return Response(
+                {
+                    'errors': 'допустимые форматы: '
+                    + ', '.join(SHOPPING_CART_FORMATS)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        writer, content_type = SHOPPING_CART_FORMATS[file_type]
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
         ).values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount'
+        ).order_by(
             'ingredient__name',
             'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        data = []
-        for ingredient in ingredients:
-            data.append(
-                f'• {ingredient["ingredient__name"]} '
-                f'({ingredient["ingredient__measurement_unit"]})'
-                f' - {ingredient["amount"]}'
-            )
+        ).iterator()
 
-        content = 'Список покупок:\n\n' + '\n'.join(data)
-        filename = 'shopping_cart.txt'
-
-        response = HttpResponse(content, content_type='text/plain')
+        filename = f'shopping_cart.{file_type}'
+        response = StreamingHttpResponse(
+            writer(ingredients),
+            content_type=content_type
+        )
         response['Content-Disposition'] = f'attachment; filename={filename}'
 
         return response
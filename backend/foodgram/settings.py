@@ -46,6 +46,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.AnonymousRecipeCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,8 +80,10 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.getenv('DB_NAME'),
+        'ENGINE': os.getenv(
+            'DB_ENGINE', default='django.db.backends.postgresql'
+        ),
+        'NAME': os.getenv('DB_NAME', default=os.path.join(BASE_DIR, 'db.sqlite3')),
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
@@ -89,6 +92,33 @@ DATABASES = {
 }
 
 
+# Кэш должен быть общим для всех процессов: через него процессы узнают
+# об изменении справочников, которые держат в памяти. В нём же лежат
+# версии рецептов, число записей для постраничного вывода и готовые ответы
+# анонимам. Под нагрузкой лучше memcached
+# (CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache,
+# CACHE_LOCATION=memcached:11211, пакет pymemcache): файловый кэш при
+# переполнении удаляет случайную треть записей, включая версии, а это лишние
+# перечитывания справочников и смена ETag.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache')
+        ),
+    }
+}
+if CACHES['default']['BACKEND'].endswith(('FileBasedCache', 'LocMemCache')):
+    # У memcached свои параметры: OPTIONS уходят клиенту как есть.
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=50000)),
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -153,6 +183,40 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'api.paginator.CustomPaginator',
 }
 
+# Число записей для постраничного вывода кешируется на несколько секунд,
+# а в PostgreSQL выше порога берётся оценка планировщика вместо COUNT(*).
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', default=30)
+)
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100000)
+)
+
+# Готовые ответы списка и страницы рецепта для анонимов; 0 отключает кэш.
+RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_TIMEOUT', default=60)
+)
+
+# Файлы картинок, которые использовались последние столько часов, не
+# удаляются, даже если на них больше не ссылается ни один рецепт: их может
+# подхватить ещё не сохранённый рецепт с той же картинкой.
+UNUSED_MEDIA_MIN_AGE = float(os.getenv('UNUSED_MEDIA_MIN_AGE', default=24))
+
+# Потоков для обработки картинок рецептов; 0 — обрабатывать сразу после
+# сохранения рецепта.
+IMAGE_PROCESSING_WORKERS = int(
+    os.getenv('IMAGE_PROCESSING_WORKERS', default=2)
+)
+
+# Пределы для картинки рецепта: размер файла в байтах и длина стороны
+# в пикселях. Проверяются до того, как картинка декодируется целиком.
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_DIMENSION = int(
+    os.getenv('RECIPE_IMAGE_MAX_DIMENSION', default=8000)
+)
+
 
 DJOSER = {
     'SERIALIZERS': {
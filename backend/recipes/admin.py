@@ -6,6 +6,7 @@ from .models import (
     Recipe,
     RecipeIngredients,
     ShoppingCart,
+    ShoppingListItem,
     Tag
 )
 
@@ -44,15 +45,35 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags', 'pub_date',)
     inlines = (RecipeIngredientsInline,)
 
+    def save_related(self, request, form, formsets, change):
+        old_amounts = ShoppingListItem.objects.recipe_amounts(form.instance.id)
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.change_recipe(
+            form.instance.id,
+            old_amounts,
+            ShoppingListItem.objects.recipe_amounts(form.instance.id)
+        )
+
     def был_добавлен_в_избранное(self, instance):
-        return instance.favorites.count()
+        return instance.favorites_count
 
 
 class RecipeIngredientsAdmin(admin.ModelAdmin):
+    '''Только просмотр: ингредиенты меняются в карточке рецепта, где
+    изменения переносятся и в готовые списки покупок.'''
     list_display = ('pk', 'recipe', 'ingredient', 'amount',)
     search_fields = ('recipe', 'ingredient',)
     list_filter = ('recipe', 'ingredient',)
 
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ['pk', 'user', 'recipe']
@@ -64,9 +85,15 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe',)
 
 
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount',)
+    search_fields = ('user__username', 'ingredient__name',)
+
+
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(RecipeIngredients, RecipeIngredientsAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(ShoppingCart, ShoppingCartAdmin)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
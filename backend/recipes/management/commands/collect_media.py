@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from api.images import VARIANTS_DIR, variant_files
+from recipes.models import Recipe
+from recipes.storage import delete_unused, is_fresh
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы картинок рецептов и их копий, на которые не ссылается '
+        'ни один рецепт.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', default=settings.UNUSED_MEDIA_MIN_AGE, type=float,
+            help=(
+                'Не трогать файлы, использованные за столько последних '
+                'часов: они могут принадлежать ещё не сохранённому рецепту.'
+            )
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что было бы удалено.'
+        )
+
+    def handle(self, *args, **options):
+        if options['min_age'] < 0:
+            raise CommandError('Возраст не может быть отрицательным!')
+        min_age = options['min_age'] * 3600
+        referenced = self.referenced()
+        removed = size = 0
+        for storage, name in self.files():
+            if name in referenced:
+                continue
+            try:
+                if is_fresh(storage.path(name), min_age):
+                    continue
+                file_size = storage.size(name)
+            except FileNotFoundError:
+                # Файл удалили, пока шёл обход: собирать уже нечего.
+                continue
+            if options['dry_run']:
+                self.stdout.write(name)
+            elif not delete_unused(storage, name, min_age):
+                continue
+            removed += 1
+            size += file_size
+        action = 'Можно удалить' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {removed}, {size // 1024} КБ'
+        ))
+
+    @staticmethod
+    def referenced():
+        referenced = set()
+        rows = Recipe.objects.exclude(image='').values_list(
+            'image', 'image_variants'
+        ).iterator()
+        for image, variants in rows:
+            referenced.add(image)
+            referenced.update(variant_files(variants))
+        return referenced
+
+    def files(self):
+        '''Пары (хранилище, имя файла) картинок и их копий.'''
+        storage = Recipe._meta.get_field('image').storage
+        for name in self.walk(storage, 'images', skip=VARIANTS_DIR):
+            yield storage, name
+        for name in self.walk(default_storage, VARIANTS_DIR):
+            yield default_storage, name
+
+    def walk(self, storage, path, skip=None):
+        if path == skip or not storage.exists(path):
+            return
+        directories, files = storage.listdir(path)
+        for name in files:
+            yield f'{path}/{name}'
+        for directory in directories:
+            yield from self.walk(storage, f'{path}/{directory}', skip)
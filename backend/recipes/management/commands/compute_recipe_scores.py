@@ -0,0 +1,78 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.middleware import invalidate_recipe_list
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+
+# Добавление в список покупок говорит о намерении готовить,
+# поэтому весит больше избранного.
+WEIGHTS = (
+    (Favorite, 1.0),
+    (ShoppingCart, 2.0),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинг популярности рецептов за последнее время '
+        'по избранному и спискам покупок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--half-life', default=72, type=float,
+            help='Период полураспада веса добавления, часов.'
+        )
+        parser.add_argument(
+            '--window', default=30, type=int,
+            help='Учитывать добавления за столько последних дней.'
+        )
+        parser.add_argument('--batch-size', default=1000, type=int)
+
+    def handle(self, *args, **options):
+        if options['half_life'] <= 0 or options['window'] <= 0:
+            raise CommandError(
+                'Период полураспада и окно должны быть положительными!'
+            )
+        now = timezone.now()
+        scores = self.collect(
+            now, options['half_life'] * 3600, options['window'],
+            options['batch_size']
+        )
+        self.save(scores, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинг пересчитан, рецептов с ненулевым рейтингом: '
+            f'{len(scores)}'
+        ))
+
+    def collect(self, now, half_life, window, batch_size):
+        '''Сумма весов добавлений, затухающих с возрастом.'''
+        scores = defaultdict(float)
+        since = now - timedelta(days=window)
+        for model, weight in WEIGHTS:
+            rows = model.objects.filter(created__gte=since).values_list(
+                'recipe_id', 'created'
+            ).iterator(chunk_size=batch_size)
+            for recipe_id, created in rows:
+                age = max((now - created).total_seconds(), 0)
+                scores[recipe_id] += weight * 0.5 ** (age / half_life)
+        return scores
+
+    @transaction.atomic
+    def save(self, scores, batch_size):
+        # В одной транзакции: читатели видят либо старый рейтинг, либо новый.
+        Recipe.objects.exclude(trending_score=0).update(trending_score=0)
+        Recipe.objects.bulk_update(
+            [
+                Recipe(pk=recipe_id, trending_score=score)
+                for recipe_id, score in scores.items()
+            ],
+            ['trending_score'],
+            batch_size=batch_size
+        )
+        transaction.on_commit(invalidate_recipe_list)
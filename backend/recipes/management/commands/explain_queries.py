@@ -0,0 +1,118 @@
+import re
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.filters import RecipeSearchFilter
+from recipes.models import Recipe, Tag
+from users.models import User
+
+
+PAGE_SIZE = 6
+INDEX_PATTERNS = {
+    'postgresql': re.compile(
+        r'Index (?:Only )?Scan (?:Backward )?using (\w+)'
+        r'|Bitmap Index Scan on (\w+)'
+    ),
+    'sqlite': re.compile(
+        r'USING (?:COVERING )?INDEX (\w+)|USING (INTEGER PRIMARY KEY)'
+    ),
+}
+FULL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'SCAN (?:TABLE )?(\w+)(?:(?! USING ).)*$', re.M),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN ANALYZE для основных выборок списка рецептов '
+        'и подписок и показывает, какие индексы использованы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Username пользователя, от имени которого строятся выборки.'
+        )
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Завершиться с ошибкой, если таблица читается целиком.'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in INDEX_PATTERNS:
+            raise CommandError(
+                f'EXPLAIN для {connection.vendor} не поддерживается!'
+            )
+        user = self.get_user(options['user'])
+        recipe = Recipe.objects.exclude(author=user).first()
+        tag = Tag.objects.first()
+        if recipe is None or tag is None:
+            raise CommandError('В базе нет рецептов или тегов!')
+        full_scans = 0
+        for name, queryset in self.queries(user, recipe.author, tag):
+            full_scans += self.explain(name, queryset, options['verbosity'])
+        if full_scans and options['strict']:
+            raise CommandError(f'Полных просмотров таблиц: {full_scans}')
+
+    def get_user(self, username):
+        if username is None:
+            user = User.objects.filter(favorites__isnull=False).first()
+        else:
+            user = User.objects.filter(username=username).first()
+        if user is None:
+            raise CommandError('Пользователь не найден!')
+        return user
+
+    def queries(self, user, author, tag):
+        request = SimpleNamespace(user=user)
+        recipes = Recipe.objects.with_user_flags(user)
+        for name, data in (
+            ('recipes', {}),
+            ('recipes?author', {'author': author.pk}),
+            ('recipes?tags', {'tags': [tag.slug]}),
+            ('recipes?is_favorited', {'is_favorited': True}),
+            ('recipes?is_in_shopping_cart', {'is_in_shopping_cart': True}),
+            ('recipes?sort=popular', {'sort': 'popular'}),
+            ('recipes?sort=trending', {'sort': 'trending'}),
+        ):
+            queryset = RecipeSearchFilter(
+                data, queryset=recipes, request=request
+            ).qs
+            yield name, queryset[:PAGE_SIZE]
+        yield 'recipes/feed', recipes.feed_of(user).order_by(
+            '-pub_date', '-id'
+        )[:PAGE_SIZE]
+        yield 'users/subscriptions', (
+            User.objects.subscriptions_of(user)[:PAGE_SIZE]
+        )
+
+    def explain(self, name, queryset, verbosity):
+        if connection.vendor == 'postgresql':
+            plan = queryset.explain(analyze=True)
+        else:
+            start = time.perf_counter()
+            list(queryset)
+            elapsed = (time.perf_counter() - start) * 1000
+            plan = f'{queryset.explain()}\nExecution Time: {elapsed:.3f} ms'
+        indexes = sorted({
+            next(group for group in match if group)
+            for match in INDEX_PATTERNS[connection.vendor].findall(plan)
+        })
+        full_scans = sorted(set(
+            FULL_SCAN_PATTERNS[connection.vendor].findall(plan)
+        ))
+        execution = re.search(r'Execution Time: ([\d.]+ ms)', plan)
+        report = (
+            f'{name}: {execution.group(1) if execution else "-"}, '
+            f'индексы: {", ".join(indexes) or "нет"}, '
+            f'полный просмотр: {", ".join(full_scans) or "нет"}'
+        )
+        style = self.style.WARNING if full_scans else self.style.SUCCESS
+        self.stdout.write(style(report))
+        if verbosity > 1:
+            self.stdout.write(plan)
+        return len(full_scans)
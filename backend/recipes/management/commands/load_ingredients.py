@@ -1,36 +1,208 @@
+import csv
+import io
 import json
 import os
+import time
+from itertools import islice
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db.utils import IntegrityError
+from django.db import connection, transaction
 
+from api.catalogue import ingredients_catalogue
 from recipes.models import Ingredient
 
 
 DATA_ROOT = os.path.join(settings.BASE_DIR, 'data')
+CHUNK_SIZE = 64 * 1024
+EXAMPLES = 10
+
+
+def skip_separators(buffer, position):
+    while position < len(buffer) and buffer[position] in ' \t\r\n,':
+        position += 1
+    return position
+
+
+def iter_json_array(file):
+    '''Читает JSON-массив объектов по одному, не загружая файл целиком.'''
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидался JSON-массив ингредиентов!')
+    position = 1
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            position = skip_separators(buffer, position)
+            if buffer[position:position + 1] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Файл с ингредиентами повреждён!')
+                break
+            yield item['name'], item['measurement_unit']
+
+
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith('.csv'):
+            rows = csv.reader(file)
+        else:
+            rows = iter_json_array(file)
+        for name, measurement_unit in rows:
+            yield name.strip(), measurement_unit.strip()
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из JSON или CSV файла в папке data/. '
+        'Повторный запуск обновляет единицы измерения и не создаёт дублей.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('filename', default='ingredients.json', nargs='?',
                             type=str)
+        parser.add_argument('--batch-size', default=500, type=int)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Показать отличия файла от базы, ничего не записывая.'
+        )
 
     def handle(self, *args, **options):
-        try:
-            with open(os.path.join(DATA_ROOT, options['filename']), 'r',
-                      encoding='utf-8') as f:
-                data = json.load(f)
-                for ingredient in data:
-                    try:
-                        Ingredient.objects.create(name=ingredient["name"],
-                                                  measurement_unit=ingredient[
-                                                      "measurement_unit"])
-                    except IntegrityError:
-                        print(f'Ingredient {ingredient["name"]} '
-                              f'{ingredient["measurement_unit"]} '
-                              f'Уже добавлен в базу данных!')
-
-        except FileNotFoundError:
+        path = os.path.join(DATA_ROOT, options['filename'])
+        if not os.path.exists(path):
             raise CommandError('Файл отсутствует в папке!')
+        start = time.perf_counter()
+        if options['dry_run']:
+            self.diff(read_rows(path))
+        else:
+            if connection.vendor == 'postgresql':
+                created, updated = self.copy_upsert(
+                    read_rows(path), options['batch_size']
+                )
+            else:
+                created, updated = self.bulk_upsert(
+                    read_rows(path), options['batch_size']
+                )
+            transaction.on_commit(ingredients_catalogue.invalidate)
+            self.stdout.write(self.style.SUCCESS(
+                f'Добавлено ингредиентов: {created}, обновлено: {updated}'
+            ))
+        self.stdout.write(f'Время: {time.perf_counter() - start:.2f} с')
+
+    def progress(self, processed):
+        self.stdout.write(f'Обработано строк: {processed}')
+
+    @transaction.atomic
+    def copy_upsert(self, rows, batch_size):
+        '''PostgreSQL: COPY во временную таблицу и один INSERT ON CONFLICT.'''
+        table = Ingredient._meta.db_table
+        processed = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_staging ('
+                'position bigserial, name varchar(200), '
+                'measurement_unit varchar(200)'
+                ') ON COMMIT DROP'
+            )
+            for batch in batches(rows, batch_size):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.cursor.copy_expert(
+                    'COPY ingredient_staging (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+                processed += len(batch)
+                self.progress(processed)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT ON (name) name, measurement_unit '
+                f'FROM ingredient_staging ORDER BY name, position '
+                f'ON CONFLICT (name) DO UPDATE '
+                f'SET measurement_unit = EXCLUDED.measurement_unit '
+                f'WHERE {table}.measurement_unit '
+                f'<> EXCLUDED.measurement_unit '
+                f'RETURNING xmax = 0'
+            )
+            inserted = [row[0] for row in cursor.fetchall()]
+        return inserted.count(True), inserted.count(False)
+
+    @transaction.atomic
+    def bulk_upsert(self, rows, batch_size):
+        '''Остальные СУБД: bulk_create и bulk_update пачками.'''
+        existing = {
+            name: (pk, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit'
+            ).iterator()
+        }
+        seen = set()
+        created = updated = processed = 0
+        for batch in batches(rows, batch_size):
+            new, changed = [], []
+            for name, measurement_unit in batch:
+                if name in seen:
+                    continue
+                seen.add(name)
+                if name not in existing:
+                    new.append(Ingredient(
+                        name=name, measurement_unit=measurement_unit
+                    ))
+                elif existing[name][1] != measurement_unit:
+                    changed.append(Ingredient(
+                        pk=existing[name][0],
+                        measurement_unit=measurement_unit
+                    ))
+            Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+            Ingredient.objects.bulk_update(changed, ['measurement_unit'])
+            created += len(new)
+            updated += len(changed)
+            processed += len(batch)
+            self.progress(processed)
+        return created, updated
+
+    def diff(self, rows):
+        existing = dict(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        seen = set()
+        new, changed, duplicates = [], [], []
+        unchanged = 0
+        for name, measurement_unit in rows:
+            if name in seen:
+                duplicates.append(name)
+                continue
+            seen.add(name)
+            if name not in existing:
+                new.append(f'+ {name} ({measurement_unit})')
+            elif existing[name] != measurement_unit:
+                changed.append(
+                    f'~ {name} ({existing[name]} -> {measurement_unit})'
+                )
+            else:
+                unchanged += 1
+        for title, lines in (
+            ('Новые', new),
+            ('Изменится единица измерения', changed),
+            ('Повторы в файле', duplicates),
+        ):
+            self.stdout.write(f'{title}: {len(lines)}')
+            for line in lines[:EXAMPLES]:
+                self.stdout.write(f'  {line}')
+        self.stdout.write(f'Без изменений: {unchanged}')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from api.images import IMAGE_ERRORS, process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит уменьшенные копии картинок рецептов, для которых их ещё нет '
+        '(например, если процесс перезапустился до окончания обработки).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Перестроить копии всех картинок.'
+        )
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'image', 'image_variants'
+        ).iterator()
+        for recipe in recipes:
+            if not options['all'] and (
+                recipe.image_variants.get('source') == recipe.image.name
+            ):
+                continue
+            try:
+                processed += process_recipe_image(recipe.pk, options['all'])
+            except IMAGE_ERRORS as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe.pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {processed}, с ошибками: {failed}'
+        ))
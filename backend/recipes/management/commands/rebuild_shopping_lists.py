@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает или сверяет сводные списки покупок с корзинами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сверить списки, ничего не изменяя.'
+        )
+        parser.add_argument('--batch-size', default=1000, type=int)
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+        else:
+            self.rebuild(options['batch_size'])
+
+    def rebuild(self, batch_size):
+        count = ShoppingListItem.objects.rebuild(batch_size=batch_size)
+        self.stdout.write(
+            self.style.SUCCESS(f'Списки покупок пересобраны: {count}')
+        )
+
+    def verify(self):
+        expected = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in (
+                ShoppingListItem.objects.expected().iterator()
+            )
+        }
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in (
+                ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'amount'
+                ).iterator()
+            )
+        }
+        mismatches = sorted(
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        )
+        for user_id, ingredient_id in mismatches[:20]:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'ожидалось {expected.get((user_id, ingredient_id))}, '
+                f'в списке {actual.get((user_id, ingredient_id))}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Расхождений в списках покупок: {len(mismatches)}'
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f'Списки покупок сходятся: {len(actual)}')
+        )
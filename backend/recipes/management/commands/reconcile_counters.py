@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики избранного, списков покупок, рецептов и '
+        'подписчиков с таблицами и исправляет разошедшиеся.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сверить счётчики, ничего не изменяя.'
+        )
+
+    def handle(self, *args, **options):
+        stale = 0
+        for model in (Recipe, User):
+            ids = list(
+                model.objects.stale_counters().values_list('pk', flat=True)
+            )
+            stale += len(ids)
+            if ids and options['verify']:
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: '
+                    f'{", ".join(map(str, ids[:20]))}'
+                )
+            elif ids:
+                model.objects.filter(pk__in=ids).recount()
+        if stale and options['verify']:
+            raise CommandError(f'Разошедшихся счётчиков: {stale}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики исправлены: {stale}' if stale else 'Счётчики сходятся'
+        ))
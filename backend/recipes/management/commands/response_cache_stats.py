@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.middleware import reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания в кэш ответов для анонимов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить счётчики после вывода.'
+        )
+
+    def handle(self, *args, **options):
+        hits, misses = stats()
+        total = hits + misses
+        ratio = hits / total * 100 if total else 0
+        self.stdout.write(
+            f'Попаданий: {hits}, промахов: {misses}, доля попаданий: '
+            f'{ratio:.1f}%'
+        )
+        if options['reset']:
+            reset_stats()
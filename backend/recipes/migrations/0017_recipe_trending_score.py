@@ -0,0 +1,42 @@
+# Generated by Django 3.2 on 2026-10-18 18:20
+
+import datetime
+
+from django.db import migrations, models
+
+
+# Время добавления старых строк неизвестно: они получают дату за пределами
+# любого окна рейтинга, иначе сразу после выката рейтинг «за последнее
+# время» совпал бы с популярностью за всё время.
+UNKNOWN_CREATED = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Рейтинг популярности за последнее время'),
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=UNKNOWN_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=UNKNOWN_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-pub_date', '-id'], name='recipe_trending_score_idx'),
+        ),
+    ]
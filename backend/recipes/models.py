@@ -1,8 +1,22 @@
 from colorfield.fields import ColorField
 from django.core.validators import MinValueValidator
-from django.db import models
-
-from users.models import User
+from django.db import connections, models, transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Value,
+    When,
+    Window
+)
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from users.models import CounterModel, CounterQuerySet, Subscription, User
+from .storage import ContentAddressedStorage
 
 
 class Tag(models.Model):
@@ -53,7 +67,124 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart')
+
+
+class RecipeQuerySet(CounterQuerySet):
+    '''Выборки рецептов для чтения через API без запросов на каждую строку.'''
+    counters = {
+        'favorites_count': ('recipes.Favorite', 'recipe'),
+        'in_carts_count': ('recipes.ShoppingCart', 'recipe'),
+    }
+
+    def with_related(self, relations=('tags', 'ingredients')):
+        lookups = {
+            'tags': 'tags',
+            'ingredients': Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredients.objects.select_related(
+                    'ingredient'
+                ).order_by('pk')
+            ),
+        }
+        return self.prefetch_related(*(
+            lookups[relation] for relation in relations
+        ))
+
+    def with_user_flags(self, user, flags=USER_FLAGS):
+        if user.is_anonymous:
+            return self.annotate(**{
+                flag: Value(False, output_field=BooleanField())
+                for flag in flags
+            })
+        related = {
+            'is_favorited': Favorite,
+            'is_in_shopping_cart': ShoppingCart,
+        }
+        return self.annotate(**{
+            flag: Exists(
+                related[flag].objects.filter(user=user, recipe=OuterRef('pk'))
+            )
+            for flag in flags
+        })
+
+    def latest_by_authors(self, authors, limit=None):
+        '''Последние рецепты каждого автора одним запросом.
+
+        С ``limit`` рецепты нумеруются через
+        ``ROW_NUMBER() OVER (PARTITION BY author)`` и отбираются первые
+        ``limit`` на автора.
+        '''
+        queryset = self.filter(author__in=authors)
+        if limit is None:
+            return queryset
+        ranked = queryset.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()]
+            )
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.model.objects.raw(
+            f'SELECT * FROM ({sql}) AS ranked '
+            f'WHERE ranked.row_number <= %s '
+            f'ORDER BY ranked.author_id, ranked.row_number',
+            (*params, limit)
+        )
+
+    def versions(self, user):
+        '''Всё, от чего зависит представление рецепта для пользователя.'''
+        fields = [
+            'pk', 'updated_at', 'is_favorited', 'is_in_shopping_cart',
+            'author__email', 'author__username',
+            'author__first_name', 'author__last_name',
+        ]
+        queryset = self.with_user_flags(user)
+        if not user.is_anonymous:
+            queryset = queryset.annotate(
+                author_is_subscribed=Exists(Subscription.objects.filter(
+                    user=user, author=OuterRef('author')
+                ))
+            )
+            fields.append('author_is_subscribed')
+        return queryset.values_list(*fields)
+
+    def feed_of(self, user):
+        '''Рецепты авторов, на которых подписан пользователь.
+
+        EXISTS по подписке превращается в полусоединение: по индексу
+        ``(pub_date, id)`` рецепты читаются в порядке ленты, и каждая строка
+        проверяется по уникальному индексу подписки ``(user, author)``,
+        поэтому первая страница не требует собирать всю ленту.
+        '''
+        return self.filter(Exists(Subscription.objects.filter(
+            user=user, author=OuterRef('author')
+        )))
+
+    def for_read(self, user, fields=None):
+        '''Выборка для ``RecipeSerializer``; ``fields`` — поля ответа:
+        связи и отметки пользователя, которых в нём нет, не загружаются.'''
+
+        def selected(names):
+            return [name for name in names if fields is None or name in fields]
+
+        queryset = self.with_related(
+            selected(('tags', 'ingredients'))
+        ).with_user_flags(user, selected(USER_FLAGS))
+        if not selected(('author',)):
+            return queryset
+        return queryset.prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.with_is_subscribed(user)
+            )
+        )
+
+
+class Recipe(CounterModel):
+    counter_fields = ('favorites_count', 'in_carts_count', 'trending_score')
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -81,7 +212,14 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         verbose_name='Изображение',
-        upload_to='images/'
+        upload_to='images/',
+        storage=ContentAddressedStorage()
+    )
+
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        editable=False
     )
 
     text = models.TextField(
@@ -102,6 +240,31 @@ class Recipe(models.Model):
         auto_now_add=True
     )
 
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    trending_score = models.FloatField(
+        verbose_name='Рейтинг популярности за последнее время',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta():
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
@@ -112,10 +275,39 @@ class Recipe(models.Model):
                 name='unique_author_name'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=['-in_carts_count', '-pub_date', '-id'],
+                name='recipe_in_carts_count_idx'
+            ),
+            models.Index(
+                fields=['-trending_score', '-pub_date', '-id'],
+                name='recipe_trending_score_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        recipe = super().from_db(db, field_names, values)
+        # Имя картинки на момент загрузки: при замене старый файл
+        # освобождается (см. ``api.images.release_image``).
+        recipe.loaded_image = recipe.__dict__.get('image')
+        return recipe
+
 
 class RecipeIngredients(models.Model):
     recipe = models.ForeignKey(
@@ -153,6 +345,142 @@ class RecipeIngredients(models.Model):
         return f'Ингредиент: {self.ingredient}, Рецепт: {self.recipe}'
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    '''Добавление и удаление рецептов пользователя одним запросом.
+
+    Проверка и запись не разделены, поэтому при одновременных запросах
+    уникальное ограничение (user, recipe) даёт успех ровно одному из них.
+    '''
+
+    def execute(self, sql, params):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def columns(self):
+        ops = connections[self.db].ops
+        meta = self.model._meta
+        return (
+            ops.quote_name(meta.db_table),
+            ops.quote_name(meta.get_field('user').column),
+            ops.quote_name(meta.get_field('recipe').column),
+            ops.quote_name(meta.get_field('created').column),
+        )
+
+    def insert(self, user_id, recipe_ids):
+        '''INSERT ... ON CONFLICT DO NOTHING; число добавленных строк.'''
+        ops = connections[self.db].ops
+        table, user, recipe, created = self.columns()
+        now = ops.adapt_datetimefield_value(timezone.now())
+        return self.execute(
+            f'{ops.insert_statement(ignore_conflicts=True)} '
+            f'{table} ({user}, {recipe}, {created}) VALUES '
+            + ', '.join(['(%s, %s, %s)'] * len(recipe_ids))
+            + f' {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+            [
+                value
+                for recipe_id in recipe_ids
+                for value in (user_id, recipe_id, now)
+            ]
+        )
+
+    def delete_rows(self, user_id, recipe_ids):
+        '''DELETE без предварительной выборки; число удалённых строк.'''
+        table, user, recipe, _ = self.columns()
+        return self.execute(
+            f'DELETE FROM {table} WHERE {user} = %s AND {recipe} IN ('
+            + ', '.join(['%s'] * len(recipe_ids)) + ')',
+            [user_id, *recipe_ids]
+        )
+
+    def present(self, user_id, recipe_ids):
+        return set(self.filter(
+            user_id=user_id, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True))
+
+    @transaction.atomic
+    def add_recipe(self, user_id, recipe_id):
+        if not self.insert(user_id, [recipe_id]):
+            return False
+        self.added(user_id, [recipe_id], True)
+        return True
+
+    @transaction.atomic
+    def remove_recipe(self, user_id, recipe_id):
+        if not self.delete_rows(user_id, [recipe_id]):
+            return False
+        self.removed(user_id, [recipe_id], True)
+        return True
+
+    @transaction.atomic
+    def add_recipes(self, user_id, recipe_ids):
+        '''Добавляет недостающие рецепты одним INSERT;
+        возвращает id добавленных.'''
+        present = self.present(user_id, recipe_ids)
+        new = [
+            recipe_id for recipe_id in recipe_ids if recipe_id not in present
+        ]
+        if new:
+            inserted = self.insert(user_id, new)
+            self.added(user_id, new, inserted == len(new))
+        return new
+
+    @transaction.atomic
+    def remove_recipes(self, user_id, recipe_ids):
+        '''Удаляет имеющиеся рецепты одним DELETE;
+        возвращает id удалённых.'''
+        present = self.present(user_id, recipe_ids)
+        present = [
+            recipe_id for recipe_id in recipe_ids if recipe_id in present
+        ]
+        if present:
+            deleted = self.delete_rows(user_id, present)
+            self.removed(user_id, present, deleted == len(present))
+        return present
+
+    def added(self, user_id, recipe_ids, exact):
+        '''Вызывается после записи. ``exact=False`` означает, что
+        параллельный запрос успел раньше и какие именно из ``recipe_ids``
+        записаны, неизвестно.'''
+        recipes = Recipe.objects.filter(pk__in=recipe_ids)
+        if exact:
+            recipes.increment(self.counter)
+        else:
+            recipes.recount(self.counter)
+
+    def removed(self, user_id, recipe_ids, exact):
+        '''То же, что :meth:`added`, для удаления.'''
+        recipes = Recipe.objects.filter(pk__in=recipe_ids)
+        if exact:
+            recipes.increment(self.counter, -1)
+        else:
+            recipes.recount(self.counter)
+
+
+class FavoriteQuerySet(UserRecipeQuerySet):
+    counter = 'favorites_count'
+
+
+class ShoppingCartQuerySet(UserRecipeQuerySet):
+    # Запись идёт мимо сигналов модели, поэтому сводный список покупок
+    # обновляется здесь же, в той же транзакции.
+    counter = 'in_carts_count'
+
+    def added(self, user_id, recipe_ids, exact):
+        super().added(user_id, recipe_ids, exact)
+        if exact:
+            ShoppingListItem.objects.add_recipes(user_id, recipe_ids)
+        else:
+            ShoppingListItem.objects.rebuild([user_id])
+
+    def removed(self, user_id, recipe_ids, exact):
+        super().removed(user_id, recipe_ids, exact)
+        if exact:
+            ShoppingListItem.objects.remove_recipes(user_id, recipe_ids)
+        else:
+            ShoppingListItem.objects.rebuild([user_id])
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -164,6 +492,13 @@ class Favorite(models.Model):
         related_name='favorites',
         on_delete=models.CASCADE
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
+
+    objects = FavoriteQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -174,6 +509,11 @@ class Favorite(models.Model):
                 name='unique_favorite'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='favorite_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.recipe.name} избран {self.user.username}'
@@ -190,6 +530,13 @@ class ShoppingCart(models.Model):
         related_name='shopping_list',
         on_delete=models.CASCADE
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
+
+    objects = ShoppingCartQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт в списке покупок'
@@ -200,6 +547,158 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='shopping_cart_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.recipe.name} в списке покупок для {self.user.username}'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    '''Поддержка сводного списка покупок в актуальном состоянии.'''
+
+    def apply(self, user_ids, amounts):
+        '''Прибавляет количества {ingredient_id: amount} к спискам
+        покупок пользователей, удаляя позиции, дошедшие до нуля.'''
+        amounts = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        if not amounts:
+            return
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id, amount in amounts.items() if amount > 0
+            ),
+            ignore_conflicts=True
+        )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        items.update(amount=F('amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(amount))
+                for ingredient_id, amount in amounts.items()
+            ),
+            default=Value(0)
+        ))
+        if min(amounts.values()) < 0:
+            items.filter(amount__lte=0).delete()
+
+    @staticmethod
+    def recipe_amounts(*recipe_ids):
+        return dict(
+            RecipeIngredients.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('ingredient_id').annotate(
+                total=models.Sum('amount')
+            ).order_by()
+        )
+
+    def add_recipe(self, user_id, recipe_id):
+        self.add_recipes(user_id, [recipe_id])
+
+    def add_recipes(self, user_id, recipe_ids):
+        self.apply([user_id], self.recipe_amounts(*recipe_ids))
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.remove_recipes(user_id, [recipe_id])
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.apply([user_id], {
+            ingredient_id: -amount
+            for ingredient_id, amount in self.recipe_amounts(
+                *recipe_ids
+            ).items()
+        })
+
+    def change_recipe(self, recipe_id, old_amounts, new_amounts):
+        '''Переносит изменение ингредиентов рецепта в списки покупок
+        всех пользователей, у которых он в корзине.'''
+        self.apply(
+            ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True),
+            {
+                ingredient_id: (
+                    new_amounts.get(ingredient_id, 0)
+                    - old_amounts.get(ingredient_id, 0)
+                )
+                for ingredient_id in old_amounts.keys() | new_amounts.keys()
+            }
+        )
+
+    @staticmethod
+    def expected(user_ids=None):
+        '''Списки покупок, посчитанные заново по корзинам.'''
+        # Одно условие на корзину: второй filter() по многозначной связи
+        # добавил бы ещё один JOIN и размножил строки.
+        if user_ids is None:
+            lookup = {'recipe__shopping_list__isnull': False}
+        else:
+            lookup = {'recipe__shopping_list__user__in': user_ids}
+        return RecipeIngredients.objects.filter(**lookup).values_list(
+            'recipe__shopping_list__user', 'ingredient'
+        ).annotate(
+            total=models.Sum('amount')
+        ).order_by()
+
+    def rebuild(self, user_ids=None, batch_size=None):
+        '''Пересчитывает списки покупок пользователей (или всех)
+        по корзинам; возвращает число позиций.'''
+        with transaction.atomic():
+            items = self.all()
+            if user_ids is not None:
+                items = items.filter(user_id__in=user_ids)
+            items.delete()
+            return len(self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount
+                    )
+                    for user_id, ingredient_id, amount in (
+                        self.expected(user_ids).iterator()
+                    )
+                ),
+                batch_size=batch_size
+            ))
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE
+    )
+    amount = models.IntegerField(
+        'Количество',
+        default=0
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Сводный список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} для {self.user}'
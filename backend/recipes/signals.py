@@ -0,0 +1,51 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Favorite, Recipe, ShoppingCart, ShoppingListItem
+from users.models import User
+
+
+def count_recipe(recipe_id, field, delta):
+    # При удалении рецепта его счётчики тоже сдвигаются: это безвредно,
+    # строка рецепта удаляется следом.
+    Recipe.objects.filter(pk=recipe_id).increment(field, delta)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+        count_recipe(instance.recipe_id, 'in_carts_count', 1)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    # pre_delete: при удалении рецепта его ингредиенты ещё на месте.
+    ShoppingListItem.objects.remove_recipe(
+        instance.user_id, instance.recipe_id
+    )
+    count_recipe(instance.recipe_id, 'in_carts_count', -1)
+
+
+@receiver(post_save, sender=Favorite)
+def count_added_favorite(sender, instance, created, **kwargs):
+    if created:
+        count_recipe(instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def count_removed_favorite(sender, instance, **kwargs):
+    count_recipe(instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def count_added_recipe(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).increment('recipes_count')
+
+
+@receiver(post_delete, sender=Recipe)
+def count_removed_recipe(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).increment('recipes_count', -1)
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import time
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+def touch(storage, name):
+    '''Отмечает существующий файл как только что использованный;
+    ``False``, если файла нет.'''
+    try:
+        os.utime(storage.path(name))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def is_fresh(path, min_age):
+    return time.time() - os.path.getmtime(path) < min_age
+
+
+def delete_unused(storage, name, min_age):
+    '''Удаляет файл, если его не использовали последние ``min_age`` секунд.
+
+    Повторное использование файла (см. :func:`touch`) может совпасть
+    с удалением: файл сначала атомарно переименовывается, и если после
+    этого видно, что его только что взяли снова, он возвращается на место.
+    Содержимое файлов с одним именем одинаково, так что возврат поверх
+    заново записанного файла ничего не портит. Если же файл взяли после
+    переименования, :func:`touch` его не найдёт и файл будет записан
+    заново.
+    '''
+    path = storage.path(name)
+    try:
+        if is_fresh(path, min_age):
+            return False
+        doomed = f'{path}.{uuid.uuid4().hex}.deleting'
+        os.rename(path, doomed)
+    except FileNotFoundError:
+        return False
+    if is_fresh(doomed, min_age):
+        os.replace(doomed, path)
+        return False
+    os.remove(doomed)
+    return True
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Файлы хранятся под именем из SHA-256 содержимого.
+
+    Одинаковые файлы записываются один раз: если файл с таким хешем уже
+    есть, сохранение обновляет время его изменения и возвращает имя.
+    Каталог (``upload_to``) и расширение исходного имени сохраняются.
+    Удалять файлы, на которые больше никто не ссылается, — забота
+    вызывающего кода (см. ``api.images.release_image`` и команду
+    ``collect_media``), и только через :func:`delete_unused`.
+    '''
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        hexdigest = digest.hexdigest()
+        name = os.path.join(
+            directory, hexdigest[:2], f'{hexdigest}{extension}'
+        )
+        if touch(self, name):
+            return name
+        return super()._save(name, content)
@@ -0,0 +1,127 @@
+import os
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+TIME_FACTOR = float(os.getenv('BENCHMARK_TIME_FACTOR', default=1))
+
+
+@dataclass
+class Budget:
+    '''Предельные затраты на один запрос к эндпоинту.'''
+    queries: int
+    seconds: float = 0.5
+    memory_kb: int = 2048
+
+
+@dataclass
+class Measurement:
+    status_code: int
+    queries: int
+    seconds: float
+    memory_kb: int
+    sql: list = field(default_factory=list, repr=False)
+
+    def check(self, budget):
+        errors = []
+        if self.queries > budget.queries:
+            errors.append(
+                f'запросов к БД {self.queries} > {budget.queries}'
+            )
+        if self.seconds > budget.seconds * TIME_FACTOR:
+            errors.append(
+                f'время {self.seconds:.3f}s > '
+                f'{budget.seconds * TIME_FACTOR:.3f}s'
+            )
+        if self.memory_kb > budget.memory_kb:
+            errors.append(
+                f'пиковая память {self.memory_kb}KB > {budget.memory_kb}KB'
+            )
+        return errors
+
+
+@dataclass
+class Scenario:
+    '''Запрос к маршруту от имени анонима или читателя датасета.'''
+    name: str
+    route: str
+    method: str
+    path: Callable[[Any], str]
+    status: int
+    budget: Budget
+    data: Optional[Callable[[Any], Any]] = None
+    auth: bool = True
+    content_type: Optional[str] = None
+
+    def __str__(self):
+        return self.name
+
+
+def _request(client, method, path, data, headers):
+    if data is None:
+        kwargs = {}
+    elif 'content_type' in headers:
+        # Готовое тело запроса: его сборка клиентом не попадает в замер.
+        kwargs = {'data': data}
+    else:
+        kwargs = {'data': data, 'format': 'json'}
+    response = getattr(client, method)(path, **kwargs, **headers)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, method, path, data=None, **headers):
+    '''Выполняет запрос, считая SQL-запросы, время и пиковую память.
+
+    tracemalloc заметно замедляет код, поэтому время и запросы снимаются
+    в первом прогоне, который затем откатывается, а память — во втором.
+    '''
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            _request(client, method, path, data, headers)
+            seconds = time.perf_counter() - start
+        sql = [query['sql'] for query in context.captured_queries]
+        transaction.set_rollback(True)
+    tracemalloc.start()
+    try:
+        response = _request(client, method, path, data, headers)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return response, Measurement(
+        status_code=response.status_code,
+        queries=len(sql),
+        seconds=seconds,
+        memory_kb=peak // 1024,
+        sql=sql
+    )
+
+
+def run_scenario(scenario, dataset, anonymous_client, reader_client):
+    client = reader_client if scenario.auth else anonymous_client
+    data = scenario.data(dataset) if scenario.data else None
+    headers = {}
+    if scenario.content_type:
+        headers['content_type'] = scenario.content_type
+    response, measurement = measure(
+        client, scenario.method, scenario.path(dataset), data, **headers
+    )
+    assert measurement.status_code == scenario.status, (
+        f'{scenario}: ожидался статус {scenario.status}, '
+        f'получен {measurement.status_code}: '
+        f'{getattr(response, "data", b"")!r}'
+    )
+    errors = measurement.check(scenario.budget)
+    assert not errors, (
+        f'{scenario}: превышен бюджет: ' + '; '.join(errors)
+        + '\n' + '\n'.join(measurement.sql)
+    )
+    return measurement
@@ -0,0 +1,45 @@
+import pytest
+from django.core.cache import caches
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from .dataset import seed
+
+
+@pytest.fixture(scope='session', autouse=True)
+def local_memory_cache():
+    with override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }):
+        yield
+
+
+@pytest.fixture(scope='session')
+def dataset(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        # Первый запрос загружает модули и маршруты — в замеры он не идёт.
+        APIClient().get('/api/tags/')
+        return seed()
+
+
+@pytest.fixture(autouse=True)
+def benchmark_settings(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    caches['default'].clear()
+    settings.PASSWORD_HASHERS = [
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ]
+
+
+@pytest.fixture
+def anonymous_client():
+    return APIClient()
+
+
+@pytest.fixture
+def reader_client(dataset):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {dataset.token}')
+    return client
@@ -0,0 +1,200 @@
+import json
+import os
+import random
+from io import StringIO
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.hashers import MD5PasswordHasher
+from django.core.management import call_command
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredients,
+    ShoppingCart,
+    Tag
+)
+from users.models import Subscription, User
+
+
+SCALE = float(os.getenv('BENCHMARK_SCALE', default=1))
+
+USERS = int(2000 * SCALE)
+RECIPES = int(4000 * SCALE)
+FAVORITES = int(20000 * SCALE)
+CARTS = int(10000 * SCALE)
+SUBSCRIPTIONS = int(10000 * SCALE)
+
+READER_FAVORITES = 200
+READER_CART = 60
+READER_SUBSCRIPTIONS = 300
+INGREDIENTS_PER_RECIPE = (3, 12)
+
+PASSWORD = 'benchmark-password'
+BATCH_SIZE = 1000
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F4C430', 'dessert'),
+    ('Перекус', '#1E90FF', 'snack'),
+)
+
+
+def _unique_pairs(count, left, right, rnd, exclude=()):
+    pairs = set(exclude)
+    result = []
+    while len(result) < count:
+        pair = (rnd.choice(left), rnd.choice(right))
+        if pair in pairs or pair[0] == pair[1]:
+            continue
+        pairs.add(pair)
+        result.append(pair)
+    return result
+
+
+def seed():
+    '''Наполняет базу синтетическими данными для замеров.'''
+    rnd = random.Random(42)
+    password = MD5PasswordHasher().encode(PASSWORD, 'benchmark')
+
+    with open(
+        os.path.join(settings.BASE_DIR, 'data', 'ingredients.json'),
+        encoding='utf-8'
+    ) as f:
+        Ingredient.objects.bulk_create(
+            (Ingredient(**row) for row in json.load(f)),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    Tag.objects.bulk_create(
+        Tag(name=name, color=color, slug=slug) for name, color, slug in TAGS
+    )
+    tags = list(Tag.objects.all())
+
+    User.objects.bulk_create(
+        (
+            User(
+                username=f'user{i}',
+                email=f'user{i}@foodgram.ru',
+                first_name=f'Имя{i}',
+                last_name=f'Фамилия{i}',
+                password=password
+            )
+            for i in range(USERS)
+        ),
+        batch_size=BATCH_SIZE
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    reader = User.objects.get(username='user0')
+
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author_id=(
+                    reader.id if i % 100 == 0 else rnd.choice(user_ids)
+                ),
+                name=f'Рецепт {i}',
+                text='Описание рецепта. ' * rnd.randint(5, 50),
+                cooking_time=rnd.randint(1, 180),
+                image='images/benchmark.png'
+            )
+            for i in range(RECIPES)
+        ),
+        batch_size=BATCH_SIZE
+    )
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+
+    recipe_tags = Recipe.tags.through
+    recipe_tags.objects.bulk_create(
+        (
+            recipe_tags(recipe_id=recipe_id, tag_id=tag.id)
+            for recipe_id in recipe_ids
+            for tag in rnd.sample(tags, rnd.randint(1, 3))
+        ),
+        batch_size=BATCH_SIZE
+    )
+    RecipeIngredients.objects.bulk_create(
+        (
+            RecipeIngredients(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rnd.randint(1, 500)
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rnd.sample(
+                ingredient_ids, rnd.randint(*INGREDIENTS_PER_RECIPE)
+            )
+        ),
+        batch_size=BATCH_SIZE
+    )
+
+    reader_favorites = [
+        (reader.id, recipe_id)
+        for recipe_id in rnd.sample(recipe_ids, READER_FAVORITES)
+    ]
+    reader_cart = [
+        (reader.id, recipe_id)
+        for recipe_id in rnd.sample(recipe_ids, READER_CART)
+    ]
+    reader_subscriptions = [
+        (reader.id, author_id)
+        for author_id in rnd.sample(user_ids[1:], READER_SUBSCRIPTIONS)
+    ]
+    Favorite.objects.bulk_create(
+        (
+            Favorite(user_id=user_id, recipe_id=recipe_id)
+            for user_id, recipe_id in reader_favorites + _unique_pairs(
+                FAVORITES, user_ids[1:], recipe_ids, rnd
+            )
+        ),
+        batch_size=BATCH_SIZE
+    )
+    ShoppingCart.objects.bulk_create(
+        (
+            ShoppingCart(user_id=user_id, recipe_id=recipe_id)
+            for user_id, recipe_id in reader_cart + _unique_pairs(
+                CARTS, user_ids[1:], recipe_ids, rnd
+            )
+        ),
+        batch_size=BATCH_SIZE
+    )
+    Subscription.objects.bulk_create(
+        (
+            Subscription(user_id=user_id, author_id=author_id)
+            for user_id, author_id in reader_subscriptions + _unique_pairs(
+                SUBSCRIPTIONS, user_ids[1:], user_ids, rnd
+            )
+        ),
+        batch_size=BATCH_SIZE
+    )
+
+    call_command('rebuild_shopping_lists', stdout=StringIO())
+    call_command('reconcile_counters', stdout=StringIO())
+
+    subscribed = {author_id for _, author_id in reader_subscriptions}
+    not_favorited = set(recipe_ids) - {
+        recipe_id for _, recipe_id in reader_favorites + reader_cart
+    }
+    return SimpleNamespace(
+        reader=reader,
+        token=Token.objects.create(user=reader).key,
+        password=PASSWORD,
+        tag=tags[0],
+        tags=tags,
+        ingredient_ids=ingredient_ids,
+        recipe=Recipe.objects.exclude(author=reader).first(),
+        own_recipe=Recipe.objects.filter(author=reader).first(),
+        free_recipe=Recipe.objects.get(pk=min(not_favorited)),
+        favorite_recipe=Recipe.objects.get(pk=reader_favorites[0][1]),
+        cart_recipe=Recipe.objects.get(pk=reader_cart[0][1]),
+        author=User.objects.get(pk=reader_subscriptions[0][1]),
+        stranger=User.objects.exclude(
+            pk__in=subscribed | {reader.id}
+        ).first()
+    )
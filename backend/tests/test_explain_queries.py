@@ -0,0 +1,22 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+
+@pytest.mark.django_db
+def test_explain_queries_reports_indexes(dataset):
+    stdout = StringIO()
+    call_command(
+        'explain_queries', '--user', dataset.reader.username,
+        verbosity=2, stdout=stdout
+    )
+    output = stdout.getvalue()
+    for name in (
+        'recipes:', 'recipes?author:', 'recipes?tags:',
+        'recipes?is_favorited:', 'recipes?is_in_shopping_cart:',
+        'users/subscriptions:',
+    ):
+        assert name in output
+    assert 'recipe_pub_date_idx' in output
+    assert 'recipe_author_pub_date_idx' in output
@@ -0,0 +1,416 @@
+import base64
+import json
+import os
+import time
+from io import BytesIO, StringIO
+
+import pytest
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+
+from api import images
+from api.images import release_image, variant_files
+from recipes import storage as storage_module
+from recipes.management.commands.collect_media import (
+    Command as CollectMedia
+)
+from recipes.models import Recipe
+from recipes.storage import delete_unused
+
+from .benchmark import measure
+from .test_recipes import recipe_payload
+
+
+def photo(size=(2000, 1000)):
+    '''JPEG с EXIF: камера и поворот на 90°.'''
+    exif = Image.Exif()
+    exif[0x010F] = 'Камера'
+    exif[0x0112] = 6
+    buffer = BytesIO()
+    Image.new('RGB', size, 'orange').save(buffer, 'JPEG', exif=exif)
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def media(url):
+    return os.path.join(
+        settings.MEDIA_ROOT, url.split(settings.MEDIA_URL, 1)[1]
+    )
+
+
+@pytest.mark.django_db
+def test_image_variants_are_built_after_commit(
+    dataset, reader_client, settings, django_capture_on_commit_callbacks
+):
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    payload = {**recipe_payload(dataset, 'Фото'), 'image': photo()}
+    with django_capture_on_commit_callbacks(execute=False) as callbacks:
+        response = reader_client.post(
+            '/api/recipes/', data=payload, format='json'
+        )
+    assert response.status_code == 201
+    # В ответе на POST копий ещё нет: их строит фоновая обработка.
+    assert response.data['images'] is None
+    etag = reader_client.get(f'/api/recipes/{response.data["id"]}/')['ETag']
+    for callback in callbacks:
+        callback()
+    # Готовые копии меняют ETag: закешированный ответ без них устарел.
+    assert reader_client.get(
+        f'/api/recipes/{response.data["id"]}/', HTTP_IF_NONE_MATCH=etag
+    ).status_code == 200
+
+    images = reader_client.get(
+        f'/api/recipes/{response.data["id"]}/'
+    ).data['images']
+    assert set(images) == {'card', 'detail'}
+    # Поворот из EXIF применён, сами метаданные не сохранены.
+    assert (images['card']['width'], images['card']['height']) == (240, 480)
+    assert images['detail']['height'] == 1200
+    for files in images.values():
+        with Image.open(media(files['webp'])) as image:
+            assert image.format == 'WEBP'
+            assert not image.getexif()
+        with Image.open(media(files['jpeg'])) as image:
+            assert image.format == 'JPEG'
+            assert not image.getexif()
+    card = os.path.getsize(media(images['card']['webp']))
+    assert card * 4 < os.path.getsize(
+        media(Recipe.objects.get(pk=response.data['id']).image.url)
+    )
+
+    listed = reader_client.get(
+        f'/api/recipes/?author={dataset.reader.id}&limit=100'
+    ).data['results']
+    assert next(
+        recipe for recipe in listed if recipe['id'] == response.data['id']
+    )['images'] == images
+
+
+@pytest.mark.django_db
+def test_replaced_image_drops_old_variants(
+    dataset, reader_client, settings, django_capture_on_commit_callbacks
+):
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    settings.UNUSED_MEDIA_MIN_AGE = 0
+    payload = {**recipe_payload(dataset, 'Фото'), 'image': photo()}
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe_id = reader_client.post(
+            '/api/recipes/', data=payload, format='json'
+        ).data['id']
+    old = Recipe.objects.get(pk=recipe_id).image_variants
+    with django_capture_on_commit_callbacks(execute=True):
+        reader_client.patch(
+            f'/api/recipes/{recipe_id}/',
+            data={**payload, 'image': photo((800, 600))}, format='json'
+        )
+    new = Recipe.objects.get(pk=recipe_id).image_variants
+    assert new['source'] != old['source']
+    assert (new['card']['width'], new['card']['height']) == (360, 480)
+    storage = Recipe._meta.get_field('image').storage
+    assert not storage.exists(old['card']['webp'])
+    assert storage.exists(new['card']['webp'])
+
+
+@pytest.mark.django_db
+def test_process_images_command(dataset, settings):
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    recipe = Recipe.objects.filter(author=dataset.reader).first()
+    storage = Recipe._meta.get_field('image').storage
+    buffer = BytesIO()
+    Image.new('RGBA', (600, 300), (0, 0, 0, 0)).save(buffer, 'PNG')
+    recipe.image = storage.save('images/pending.png', buffer)
+    Recipe.objects.filter(pk=recipe.pk).update(image=recipe.image)
+
+    stdout, stderr = StringIO(), StringIO()
+    call_command('process_images', stdout=stdout, stderr=stderr)
+    # У остальных рецептов файла картинки в тестовой базе нет.
+    assert 'Обработано картинок: 1' in stdout.getvalue()
+    variants = Recipe.objects.get(pk=recipe.pk).image_variants
+    assert variants['source'] == recipe.image
+    assert variants['card']['png'].endswith('.png')
+
+    stdout = StringIO()
+    call_command('process_images', stdout=stdout, stderr=StringIO())
+    assert 'Обработано картинок: 0' in stdout.getvalue()
+
+
+@pytest.mark.django_db
+def test_decompression_bomb_is_logged(
+    dataset, settings, monkeypatch, caplog
+):
+    recipe = Recipe.objects.filter(author=dataset.reader).first()
+    storage = Recipe._meta.get_field('image').storage
+    buffer = BytesIO()
+    Image.new('RGB', (600, 300), 'orange').save(buffer, 'PNG')
+    recipe.image = storage.save('images/bomb.png', buffer)
+    Recipe.objects.filter(pk=recipe.pk).update(image=recipe.image)
+    # Меньше половины пикселей картинки: Pillow считает её бомбой.
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 600 * 300 // 3)
+    # Соединение теста закрывать нельзя.
+    monkeypatch.setattr(images.connections, 'close_all', lambda: None)
+
+    images.run(recipe.pk)
+    assert f'картинку рецепта {recipe.pk}' in caplog.text
+    stderr = StringIO()
+    call_command('process_images', stdout=StringIO(), stderr=stderr)
+    assert f'Рецепт {recipe.pk}:' in stderr.getvalue()
+    assert not Recipe.objects.get(pk=recipe.pk).image_variants
+
+
+@pytest.mark.django_db
+def test_same_image_is_stored_once(
+    dataset, reader_client, settings, django_capture_on_commit_callbacks
+):
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    settings.UNUSED_MEDIA_MIN_AGE = 0
+    image = photo()
+    ids = []
+    for name in ('Первый', 'Второй'):
+        with django_capture_on_commit_callbacks(execute=True):
+            ids.append(reader_client.post(
+                '/api/recipes/',
+                data={**recipe_payload(dataset, name), 'image': image},
+                format='json'
+            ).data['id'])
+    first, second = Recipe.objects.filter(pk__in=ids).order_by('pk')
+    assert first.image.name == second.image.name
+    assert first.image_variants == second.image_variants
+    storage = Recipe._meta.get_field('image').storage
+    directory = os.path.dirname(first.image.name)
+    assert storage.listdir(directory)[1] == [
+        os.path.basename(first.image.name)
+    ]
+
+    # Файл общий: удаление одного из рецептов его не трогает.
+    with django_capture_on_commit_callbacks(execute=True):
+        reader_client.delete(f'/api/recipes/{first.id}/')
+    assert storage.exists(second.image.name)
+    assert storage.exists(second.image_variants['card']['webp'])
+    with django_capture_on_commit_callbacks(execute=True):
+        reader_client.delete(f'/api/recipes/{second.id}/')
+    assert not storage.exists(second.image.name)
+    assert not storage.exists(second.image_variants['card']['webp'])
+
+
+@pytest.mark.django_db
+def test_release_keeps_recently_reused_image(
+    dataset, reader_client, settings, django_capture_on_commit_callbacks
+):
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    settings.UNUSED_MEDIA_MIN_AGE = 1
+    payload = {**recipe_payload(dataset, 'Фото'), 'image': photo()}
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe_id = reader_client.post(
+            '/api/recipes/', data=payload, format='json'
+        ).data['id']
+    recipe = Recipe.objects.get(pk=recipe_id)
+    storage = Recipe._meta.get_field('image').storage
+    files = [
+        (storage, recipe.image.name),
+        *((default_storage, name)
+          for name in variant_files(recipe.image_variants)),
+    ]
+
+    def age():
+        for file_storage, name in files:
+            hour_ago = time.time() - 3600
+            os.utime(file_storage.path(name), (hour_ago, hour_ago))
+
+    # Другой рецепт загружает ту же картинку, пока у первого её меняют:
+    # файл не записывается заново, но и удалить его уже нельзя.
+    age()
+    assert storage.save(
+        'images/same.jpg', ContentFile(recipe.image.read())
+    ) == recipe.image.name
+    with django_capture_on_commit_callbacks(execute=True):
+        reader_client.patch(
+            f'/api/recipes/{recipe_id}/',
+            data={**payload, 'image': photo((800, 600))}, format='json'
+        )
+    assert storage.exists(recipe.image.name)
+
+    age()
+    assert release_image(recipe.image.name)
+    assert not any(
+        file_storage.exists(name) for file_storage, name in files
+    )
+
+
+def test_delete_unused_restores_file_taken_during_delete(monkeypatch):
+    storage = Recipe._meta.get_field('image').storage
+    name = storage.save('images/taken.png', ContentFile(b'taken'))
+    hour_ago = time.time() - 3600
+    os.utime(storage.path(name), (hour_ago, hour_ago))
+    rename = os.rename
+
+    def rename_and_touch(source, target):
+        # Файл подхватили между проверкой и переименованием.
+        os.utime(source)
+        rename(source, target)
+
+    monkeypatch.setattr(storage_module.os, 'rename', rename_and_touch)
+    assert not delete_unused(storage, name, 60)
+    assert storage.exists(name)
+    monkeypatch.setattr(storage_module.os, 'rename', rename)
+    os.utime(storage.path(name), (hour_ago, hour_ago))
+    assert delete_unused(storage, name, 60)
+    assert not storage.exists(name)
+
+
+@pytest.mark.django_db
+def test_collect_media_command(dataset, settings, monkeypatch):
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    recipe = Recipe.objects.filter(author=dataset.reader).first()
+    storage = Recipe._meta.get_field('image').storage
+    buffer = BytesIO()
+    Image.new('RGB', (600, 300), 'green').save(buffer, 'PNG')
+    Recipe.objects.filter(pk=recipe.pk).update(
+        image=storage.save('images/kept.png', buffer)
+    )
+    call_command('process_images', stdout=StringIO(), stderr=StringIO())
+    recipe.refresh_from_db()
+    orphan = storage.save('images/orphan.png', BytesIO(b'orphan'))
+    kept = [recipe.image.name, *variant_files(recipe.image_variants)]
+
+    stdout = StringIO()
+    call_command('collect_media', stdout=stdout)
+    # Свежие файлы могут принадлежать рецепту, который ещё сохраняется.
+    assert 'Удалено файлов: 0' in stdout.getvalue()
+    stdout = StringIO()
+    call_command('collect_media', '--min-age=0', '--dry-run', stdout=stdout)
+    assert orphan in stdout.getvalue()
+    assert 'Можно удалить файлов: 1' in stdout.getvalue()
+    assert storage.exists(orphan)
+
+    stdout = StringIO()
+    call_command('collect_media', '--min-age=0', stdout=stdout)
+    assert 'Удалено файлов: 1' in stdout.getvalue()
+    assert not storage.exists(orphan)
+    assert all(storage.exists(name) for name in kept)
+
+    # Файл, удалённый между обходом каталога и проверкой, пропускается.
+    files = CollectMedia.files
+    monkeypatch.setattr(CollectMedia, 'files', lambda self: [
+        (storage, 'images/vanished.png'), *files(self)
+    ])
+    stdout = StringIO()
+    call_command('collect_media', '--min-age=0', stdout=stdout)
+    assert 'Удалено файлов: 0' in stdout.getvalue()
+
+
+def noise(size=(1500, 1000)):
+    '''JPEG из шума: сжимается плохо, как настоящая фотография.'''
+    buffer = BytesIO()
+    Image.frombytes(
+        'RGB', size, os.urandom(size[0] * size[1] * 3)
+    ).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def multipart_body(dataset, name, image):
+    payload = recipe_payload(dataset, name)
+    del payload['image']
+    return encode_multipart(BOUNDARY, {
+        'data': json.dumps(payload),
+        'image': SimpleUploadedFile('photo.jpg', image, 'image/jpeg'),
+    })
+
+
+def json_body(dataset, name, image):
+    return json.dumps({
+        **recipe_payload(dataset, name),
+        'image': 'data:image/jpeg;base64,' + base64.b64encode(
+            image
+        ).decode(),
+    }).encode()
+
+
+@pytest.mark.django_db
+def test_multipart_upload(dataset, reader_client):
+    image = noise((300, 200))
+    response = reader_client.post(
+        '/api/recipes/', data=multipart_body(dataset, 'Файлом', image),
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 201, response.data
+    recipe = Recipe.objects.get(pk=response.data['id'])
+    assert recipe.image.read() == image
+    assert recipe.recipeingredients.count() == len(
+        recipe_payload(dataset, 'Файлом')['ingredients']
+    )
+
+    response = reader_client.patch(
+        f'/api/recipes/{recipe.id}/',
+        data=multipart_body(dataset, 'Другим файлом', noise((200, 100))),
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 200, response.data
+    assert Recipe.objects.get(pk=recipe.id).image.width == 200
+    response = reader_client.post(
+        '/api/recipes/',
+        data=encode_multipart(BOUNDARY, {'data': '[1]'}),
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_upload_limits(dataset, reader_client, settings):
+    image = noise((300, 200))
+    settings.RECIPE_IMAGE_MAX_SIZE = len(image) - 1
+    response = reader_client.post(
+        '/api/recipes/', data=multipart_body(dataset, 'Большая', image),
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 413
+    response = reader_client.post(
+        '/api/recipes/', data=json_body(dataset, 'Большая', image),
+        content_type='application/json'
+    )
+    assert response.status_code == 400
+    assert 'image' in response.data
+
+    settings.RECIPE_IMAGE_MAX_SIZE = len(image)
+    settings.RECIPE_IMAGE_MAX_DIMENSION = 299
+    for body, content_type in (
+        (multipart_body(dataset, 'Широкая', image), MULTIPART_CONTENT),
+        (json_body(dataset, 'Широкая', image), 'application/json'),
+    ):
+        response = reader_client.post(
+            '/api/recipes/', data=body, content_type=content_type
+        )
+        assert response.status_code == 400
+        assert 'image' in response.data
+    assert not Recipe.objects.filter(name__in=('Большая', 'Широкая'))
+
+
+@pytest.mark.django_db
+def test_multipart_upload_memory(dataset, reader_client):
+    image = noise()
+    assert len(image) > 1024 * 1024
+    # Тела запросов собираются заранее: в замер идёт только сервер.
+    _, multipart = measure(
+        reader_client, 'post', '/api/recipes/',
+        multipart_body(dataset, 'Файлом', image),
+        content_type=MULTIPART_CONTENT
+    )
+    _, base64_json = measure(
+        reader_client, 'post', '/api/recipes/',
+        json_body(dataset, 'Строкой', image),
+        content_type='application/json'
+    )
+    assert multipart.status_code == base64_json.status_code == 201
+    print(
+        f'\nпиковая память на загрузку {len(image) // 1024}KB: '
+        f'multipart {multipart.memory_kb}KB, '
+        f'base64 в JSON {base64_json.memory_kb}KB'
+    )
+    # Тестовый клиент сам держит копию тела запроса, так что multipart
+    # почти целиком — это она; base64 вдобавок декодируется в памяти.
+    assert multipart.memory_kb * 3 < base64_json.memory_kb
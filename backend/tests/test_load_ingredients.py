@@ -0,0 +1,39 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from recipes.models import Ingredient
+
+
+def load_ingredients(*args):
+    stdout = StringIO()
+    call_command('load_ingredients', *args, stdout=stdout)
+    return stdout.getvalue()
+
+
+@pytest.mark.django_db
+def test_load_ingredients_is_idempotent(
+    dataset, django_assert_max_num_queries
+):
+    count = Ingredient.objects.count()
+    with django_assert_max_num_queries(10):
+        output = load_ingredients('--batch-size', '1000')
+    assert 'Добавлено ингредиентов: 0, обновлено: 0' in output
+    load_ingredients('ingredients.csv')
+    assert Ingredient.objects.count() == count
+
+
+@pytest.mark.django_db
+def test_load_ingredients_dry_run_and_upsert(dataset):
+    ingredient = Ingredient.objects.get(name='агар-агар')
+    Ingredient.objects.filter(pk=ingredient.pk).update(measurement_unit='кг')
+    output = load_ingredients('--dry-run')
+    assert 'Изменится единица измерения: 1' in output
+    assert 'Повторы в файле: 2' in output
+    ingredient.refresh_from_db()
+    assert ingredient.measurement_unit == 'кг'
+    output = load_ingredients()
+    assert 'Добавлено ингредиентов: 0, обновлено: 1' in output
+    ingredient.refresh_from_db()
+    assert ingredient.measurement_unit == 'г'
@@ -0,0 +1,131 @@
+import time
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.readers import RecipeReader
+from api.serializers import RecipeSerializer
+from api.views import RecipeViewSet
+from recipes.models import Recipe
+
+
+BENCHMARK_RECIPES = 200
+BENCHMARK_ROUNDS = 5
+
+
+def special_recipes(dataset):
+    '''Рецепты со всеми вариантами полей: в избранном, в списке покупок,
+    автора из подписок, с копиями картинки и без картинки.'''
+    followed = Recipe.objects.feed_of(dataset.reader).first()
+    with_variants, without_image = Recipe.objects.exclude(
+        pk__in=(dataset.favorite_recipe.pk, dataset.cart_recipe.pk)
+    ).order_by('pk')[:2]
+    Recipe.objects.filter(pk=with_variants.pk).update(image_variants={
+        'source': 'images/benchmark.png',
+        'card': {
+            'width': 480, 'height': 240,
+            'webp': 'images/variants/benchmark-png-card.webp',
+            'png': 'images/variants/benchmark-png-card.png',
+        },
+    })
+    Recipe.objects.filter(pk=without_image.pk).update(image='')
+    return [
+        dataset.favorite_recipe.pk, dataset.cart_recipe.pk, followed.pk,
+        with_variants.pk, without_image.pk,
+    ]
+
+
+def api_request(user):
+    request = Request(APIRequestFactory().get('/api/recipes/'))
+    request.user = user
+    return request
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('authenticated', (True, False))
+def test_reader_matches_serializer(dataset, authenticated):
+    user = dataset.reader if authenticated else AnonymousUser()
+    ids = special_recipes(dataset) + list(
+        Recipe.objects.values_list('pk', flat=True)[:50]
+    )
+    context = {'request': api_request(user)}
+    expected = RecipeSerializer(
+        Recipe.objects.for_read(user).filter(pk__in=ids), many=True,
+        context=context
+    ).data
+    recipes = Recipe.objects.with_user_flags(user).filter(pk__in=ids)
+    actual = RecipeReader(recipes, many=True, context=context).data
+    assert JSONRenderer().render(actual) == JSONRenderer().render(expected)
+    detail = next(row for row in expected if row['id'] == ids[0])
+    assert JSONRenderer().render(
+        RecipeReader(recipes.get(pk=ids[0]), context=context).data
+    ) == JSONRenderer().render(detail)
+    if authenticated:
+        flags = {
+            row['id']: (
+                row['is_favorited'], row['is_in_shopping_cart'],
+                row['author']['is_subscribed']
+            )
+            for row in actual
+        }
+        assert flags[dataset.favorite_recipe.pk][0]
+        assert flags[dataset.cart_recipe.pk][1]
+        assert flags[ids[2]][2]
+
+
+@pytest.mark.django_db
+def test_reader_is_selectable_per_viewset(
+    dataset, reader_client, monkeypatch
+):
+    special_recipes(dataset)
+    paths = (
+        '/api/recipes/?limit=50',
+        f'/api/recipes/{dataset.favorite_recipe.pk}/',
+        '/api/recipes/feed/?limit=50',
+    )
+    fast = [reader_client.get(path).content for path in paths]
+    monkeypatch.setattr(RecipeViewSet, 'reader_class', None)
+    assert [reader_client.get(path).content for path in paths] == fast
+
+
+@pytest.mark.django_db
+def test_reader_benchmark(dataset):
+    context = {'request': api_request(dataset.reader)}
+    ids = list(
+        Recipe.objects.values_list('pk', flat=True)[:BENCHMARK_RECIPES]
+    )
+
+    def serializer():
+        return RecipeSerializer(
+            Recipe.objects.for_read(dataset.reader).filter(pk__in=ids),
+            many=True, context=context
+        ).data
+
+    def reader():
+        return RecipeReader(
+            Recipe.objects.with_user_flags(dataset.reader).filter(
+                pk__in=ids
+            ),
+            many=True, context=context
+        ).data
+
+    rates = {}
+    for name, read in (('RecipeSerializer', serializer),
+                       ('RecipeReader', reader)):
+        best = min(
+            timed(read) for _ in range(BENCHMARK_ROUNDS)
+        )
+        rates[name] = len(ids) / best
+    print('\n' + ', '.join(
+        f'{name}: {rate:.0f} рецептов/с' for name, rate in rates.items()
+    ))
+    assert rates['RecipeReader'] > rates['RecipeSerializer']
+
+
+def timed(read):
+    start = time.perf_counter()
+    read()
+    return time.perf_counter() - start
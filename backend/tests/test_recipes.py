@@ -0,0 +1,892 @@
+import base64
+import json
+import logging
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (
+    Favorite, Recipe, RecipeIngredients, ShoppingCart, Tag
+)
+from users.models import Subscription, User
+
+from api.readers import RECIPE_FIELDS
+from api.views import RecipeViewSet
+from .benchmark import Budget, Scenario, measure, run_scenario
+
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAA'
+    'CVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNo'
+    'AAAAggCByxOyYQAAAABJRU5ErkJggg=='
+)
+
+CARD_FIELDS = 'id,name,image,cooking_time,tags,author'
+
+
+def recipe_payload(dataset, name):
+    return {
+        'name': name,
+        'text': 'Замер создания рецепта',
+        'cooking_time': 15,
+        'image': IMAGE,
+        'tags': [tag.id for tag in dataset.tags[:2]],
+        'ingredients': [
+            {'id': ingredient_id, 'amount': 10}
+            for ingredient_id in dataset.ingredient_ids[:8]
+        ],
+    }
+
+
+def recipe_cursor(position):
+    recipe = Recipe.objects.order_by('-pub_date', '-id')[position]
+    return base64.urlsafe_b64encode(json.dumps(
+        [False, recipe.pub_date.isoformat(), str(recipe.id)]
+    ).encode()).decode()
+
+
+def bulk_recipe_ids(dataset):
+    return [
+        dataset.free_recipe.id,
+        dataset.favorite_recipe.id,
+        dataset.cart_recipe.id,
+        *Recipe.objects.exclude(author=dataset.reader).order_by(
+            '-id'
+        ).values_list('id', flat=True)[:20],
+    ]
+
+
+SCENARIOS = [
+    Scenario(
+        'api-root', 'api-root', 'get',
+        lambda d: '/api/', 200, Budget(queries=1)
+    ),
+    Scenario(
+        'tag-list', 'tag-list', 'get',
+        lambda d: '/api/tags/', 200, Budget(queries=1), auth=False
+    ),
+    Scenario(
+        'tag-detail', 'tag-detail', 'get',
+        lambda d: f'/api/tags/{d.tag.id}/', 200, Budget(queries=1),
+        auth=False
+    ),
+    Scenario(
+        'ingredient-list', 'ingredient-list', 'get',
+        lambda d: '/api/ingredients/', 200,
+        Budget(queries=1, seconds=1.0, memory_kb=8192), auth=False
+    ),
+    Scenario(
+        'ingredient-list-search', 'ingredient-list', 'get',
+        lambda d: '/api/ingredients/?name=мак', 200, Budget(queries=1),
+        auth=False
+    ),
+    Scenario(
+        'ingredient-detail', 'ingredient-detail', 'get',
+        lambda d: f'/api/ingredients/{d.ingredient_ids[0]}/', 200,
+        Budget(queries=1), auth=False
+    ),
+    Scenario(
+        'recipe-list-anonymous', 'recipe-list', 'get',
+        lambda d: '/api/recipes/', 200, Budget(queries=5), auth=False
+    ),
+    Scenario(
+        'recipe-list', 'recipe-list', 'get',
+        lambda d: '/api/recipes/', 200, Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-list-limit-100', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?limit=100', 200,
+        Budget(queries=6, seconds=1.5, memory_kb=8192)
+    ),
+    Scenario(
+        'recipe-list-deep-page', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?page=500', 200, Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-list-cursor', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?cursor=', 200, Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-list-cursor-deep-without-count', 'recipe-list', 'get',
+        lambda d: f'/api/recipes/?cursor={recipe_cursor(3000)}&count=false',
+        200, Budget(queries=5)
+    ),
+    Scenario(
+        'recipe-list-trending', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?sort=trending', 200, Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-list-cards', 'recipe-list', 'get',
+        lambda d: f'/api/recipes/?fields={CARD_FIELDS}', 200,
+        Budget(queries=5)
+    ),
+    Scenario(
+        'recipe-list-fields-without-relations', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?limit=100&fields=id,name,cooking_time',
+        200, Budget(queries=3)
+    ),
+    Scenario(
+        'recipe-list-unknown-field', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?fields=id,password', 400,
+        Budget(queries=1)
+    ),
+    Scenario(
+        'recipe-feed', 'recipe-feed', 'get',
+        lambda d: '/api/recipes/feed/', 200, Budget(queries=5)
+    ),
+    Scenario(
+        'recipe-feed-deep', 'recipe-feed', 'get',
+        lambda d: f'/api/recipes/feed/?cursor={recipe_cursor(3000)}',
+        200, Budget(queries=5)
+    ),
+    Scenario(
+        'recipe-feed-anonymous', 'recipe-feed', 'get',
+        lambda d: '/api/recipes/feed/', 401, Budget(queries=0), auth=False
+    ),
+    Scenario(
+        'recipe-list-invalid-cursor', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?cursor=abc', 404, Budget(queries=1)
+    ),
+    Scenario(
+        'recipe-list-tags', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?tags=breakfast&tags=lunch&tags=dinner',
+        200, Budget(queries=7)
+    ),
+    Scenario(
+        'recipe-list-all-tags', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?tags=breakfast&tags=lunch&tags_mode=all',
+        200, Budget(queries=7)
+    ),
+    Scenario(
+        'recipe-list-author', 'recipe-list', 'get',
+        lambda d: f'/api/recipes/?author={d.author.id}', 200,
+        Budget(queries=7)
+    ),
+    Scenario(
+        'recipe-list-favorited', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?is_favorited=1', 200, Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-list-in-shopping-cart', 'recipe-list', 'get',
+        lambda d: '/api/recipes/?is_in_shopping_cart=1', 200,
+        Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-detail-anonymous', 'recipe-detail', 'get',
+        lambda d: f'/api/recipes/{d.recipe.id}/', 200, Budget(queries=5),
+        auth=False
+    ),
+    Scenario(
+        'recipe-detail', 'recipe-detail', 'get',
+        lambda d: f'/api/recipes/{d.recipe.id}/', 200, Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-create', 'recipe-list', 'post',
+        lambda d: '/api/recipes/', 201, Budget(queries=31, memory_kb=4096),
+        data=lambda d: recipe_payload(d, 'Новый рецепт')
+    ),
+    Scenario(
+        'recipe-update', 'recipe-detail', 'patch',
+        lambda d: f'/api/recipes/{d.own_recipe.id}/', 200,
+        Budget(queries=40),
+        data=lambda d: recipe_payload(d, 'Обновлённый рецепт')
+    ),
+    Scenario(
+        'recipe-delete', 'recipe-detail', 'delete',
+        lambda d: f'/api/recipes/{d.own_recipe.id}/', 204,
+        Budget(queries=31)
+    ),
+    Scenario(
+        'recipe-favorite-add', 'recipe-favorite', 'post',
+        lambda d: f'/api/recipes/{d.free_recipe.id}/favorite/', 201,
+        Budget(queries=6)
+    ),
+    Scenario(
+        'recipe-favorite-remove', 'recipe-favorite', 'delete',
+        lambda d: f'/api/recipes/{d.favorite_recipe.id}/favorite/', 204,
+        Budget(queries=5)
+    ),
+    Scenario(
+        'recipe-shopping-cart-add', 'recipe-shopping-cart', 'post',
+        lambda d: f'/api/recipes/{d.free_recipe.id}/shopping_cart/', 201,
+        Budget(queries=9)
+    ),
+    Scenario(
+        'recipe-shopping-cart-remove', 'recipe-shopping-cart', 'delete',
+        lambda d: f'/api/recipes/{d.cart_recipe.id}/shopping_cart/', 204,
+        Budget(queries=8)
+    ),
+    Scenario(
+        'recipe-favorite-bulk-add', 'recipe-favorite-bulk', 'post',
+        lambda d: '/api/recipes/favorite/', 200, Budget(queries=9),
+        data=lambda d: {'ids': bulk_recipe_ids(d)}
+    ),
+    Scenario(
+        'recipe-favorite-bulk-remove', 'recipe-favorite-bulk', 'delete',
+        lambda d: '/api/recipes/favorite/', 200, Budget(queries=9),
+        data=lambda d: {'ids': bulk_recipe_ids(d)}
+    ),
+    Scenario(
+        'recipe-shopping-cart-bulk-add', 'recipe-shopping-cart-bulk', 'post',
+        lambda d: '/api/recipes/shopping_cart/', 200, Budget(queries=12),
+        data=lambda d: {'ids': bulk_recipe_ids(d)}
+    ),
+    Scenario(
+        'recipe-shopping-cart-bulk-remove', 'recipe-shopping-cart-bulk',
+        'delete', lambda d: '/api/recipes/shopping_cart/', 200,
+        Budget(queries=12), data=lambda d: {'ids': bulk_recipe_ids(d)}
+    ),
+    Scenario(
+        'recipe-download-shopping-cart', 'recipe-download-shopping-cart',
+        'get', lambda d: '/api/recipes/download_shopping_cart/', 200,
+        Budget(queries=2)
+    ),
+    Scenario(
+        'recipe-download-shopping-cart-csv', 'recipe-download-shopping-cart',
+        'get', lambda d: '/api/recipes/download_shopping_cart/?type=csv',
+        200, Budget(queries=2)
+    ),
+    Scenario(
+        'recipe-download-shopping-cart-json',
+        'recipe-download-shopping-cart', 'get',
+        lambda d: '/api/recipes/download_shopping_cart/?type=json', 200,
+        Budget(queries=2)
+    ),
+    Scenario(
+        'recipe-download-shopping-cart-invalid-type',
+        'recipe-download-shopping-cart', 'get',
+        lambda d: '/api/recipes/download_shopping_cart/?type=pdf', 400,
+        Budget(queries=1)
+    ),
+]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('scenario', SCENARIOS, ids=str)
+def test_recipes_budget(scenario, dataset, anonymous_client, reader_client):
+    run_scenario(scenario, dataset, anonymous_client, reader_client)
+
+
+@pytest.mark.django_db
+def test_recipe_list_queries_do_not_depend_on_page_size(reader_client):
+    queries = {}
+    for limit in (1, 6, 100):
+        caches['default'].clear()
+        queries[limit] = measure(
+            reader_client, 'get', f'/api/recipes/?limit={limit}'
+        )[1].queries
+    assert len(set(queries.values())) == 1, queries
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('path', ['/api/tags/', '/api/ingredients/?name=мак'])
+def test_catalogue_is_served_from_memory(path, anonymous_client):
+    anonymous_client.get(path)
+    assert measure(anonymous_client, 'get', path)[1].queries == 0
+
+
+@pytest.mark.django_db
+def test_catalogue_is_invalidated_on_change(
+    anonymous_client, django_capture_on_commit_callbacks
+):
+    anonymous_client.get('/api/tags/')
+    with django_capture_on_commit_callbacks(execute=True):
+        Tag.objects.create(name='Новый тег', color='#000001', slug='new')
+    slugs = [tag['slug'] for tag in anonymous_client.get('/api/tags/').data]
+    assert 'new' in slugs
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('client_name, queries', [
+    # Аноним получает 304 из кэша ответов, без обращения к БД.
+    ('anonymous_client', 0),
+    ('reader_client', 2),
+])
+def test_recipe_detail_not_modified(
+    client_name, queries, dataset, request, django_capture_on_commit_callbacks
+):
+    client = request.getfixturevalue(client_name)
+    path = f'/api/recipes/{dataset.recipe.id}/'
+    etag = client.get(path)['ETag']
+    response, measurement = measure(
+        client, 'get', path, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 304
+    assert measurement.queries == queries
+
+    Recipe.objects.filter(pk=dataset.recipe.id).update(name='Другое имя')
+    assert client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    with django_capture_on_commit_callbacks(execute=True):
+        Recipe.objects.get(pk=dataset.recipe.id).save()
+    assert client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_recipe_etag_follows_favorites(dataset, reader_client):
+    path = f'/api/recipes/{dataset.free_recipe.id}/'
+    etag = reader_client.get(path)['ETag']
+    reader_client.post(f'{path}favorite/')
+    response = reader_client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data['is_favorited']
+
+
+@pytest.mark.django_db
+def test_catalogue_not_modified(anonymous_client):
+    response = anonymous_client.get('/api/tags/')
+    response = anonymous_client.get(
+        '/api/tags/',
+        HTTP_IF_NONE_MATCH=response['ETag'],
+        HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+    )
+    assert response.status_code == 304
+
+
+def walk(client, url, link):
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([recipe['id'] for recipe in response.data['results']])
+        url = response.data[link]
+    return pages
+
+
+@pytest.mark.django_db
+def test_anonymous_response_cache(
+    dataset, anonymous_client, reader_client,
+    django_capture_on_commit_callbacks
+):
+    path = (
+        f'/api/recipes/?tags={dataset.tags[0].slug}'
+        f'&tags={dataset.tags[1].slug}&limit=3'
+    )
+    first = anonymous_client.get(path)
+    assert first['X-Cache'] == 'MISS'
+    # Порядок параметров не важен: строка запроса нормализуется.
+    reordered = (
+        f'/api/recipes/?limit=3&tags={dataset.tags[1].slug}'
+        f'&tags={dataset.tags[0].slug}'
+    )
+    response, measurement = measure(anonymous_client, 'get', reordered)
+    assert response['X-Cache'] == 'HIT'
+    assert measurement.queries == 0
+    assert response.json() == first.json()
+    assert 'X-Cache' not in reader_client.get(path)
+    out = StringIO()
+    call_command('response_cache_stats', '--reset', stdout=out)
+    assert 'промахов: 1' in out.getvalue()
+
+    detail = f'/api/recipes/{dataset.recipe.id}/'
+    assert anonymous_client.get(detail)['X-Cache'] == 'MISS'
+    assert anonymous_client.get(detail)['X-Cache'] == 'HIT'
+    with django_capture_on_commit_callbacks(execute=True):
+        Recipe.objects.filter(pk=dataset.own_recipe.id).get().save()
+    # Изменение одного рецепта сбрасывает списки, но не чужие страницы.
+    assert anonymous_client.get(detail)['X-Cache'] == 'HIT'
+    assert anonymous_client.get(path)['X-Cache'] == 'MISS'
+    with django_capture_on_commit_callbacks(execute=True):
+        Tag.objects.filter(pk=dataset.tag.id).get().save()
+    assert anonymous_client.get(detail)['X-Cache'] == 'MISS'
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command('compute_recipe_scores', stdout=StringIO())
+    assert anonymous_client.get(path)['X-Cache'] == 'MISS'
+
+
+@pytest.mark.django_db
+def test_response_cache_normalizes_recipe_id(
+    dataset, anonymous_client, django_capture_on_commit_callbacks
+):
+    recipe = dataset.recipe
+    assert anonymous_client.get(f'/api/recipes/{recipe.id}/')[
+        'X-Cache'
+    ] == 'MISS'
+    padded = f'/api/recipes/0{recipe.id}/'
+    assert anonymous_client.get(padded)['X-Cache'] == 'HIT'
+    with django_capture_on_commit_callbacks(execute=True):
+        Recipe.objects.filter(pk=recipe.id).update(name='Новое имя')
+        Recipe.objects.get(pk=recipe.id).save()
+    response = anonymous_client.get(padded)
+    assert response['X-Cache'] == 'MISS'
+    assert response.json()['name'] == 'Новое имя'
+
+
+@pytest.mark.django_db
+def test_recipe_cursor_pagination(dataset, reader_client):
+    expected = list(
+        Recipe.objects.filter(author=dataset.reader)
+        .order_by('-pub_date', '-id').values_list('id', flat=True)
+    )
+    pages = walk(
+        reader_client,
+        f'/api/recipes/?cursor=&limit=7&author={dataset.reader.id}',
+        'next'
+    )
+    assert len(pages) > 2
+    assert sum(pages, []) == expected
+    last = reader_client.get(
+        f'/api/recipes/?cursor=&limit=7&author={dataset.reader.id}'
+    )
+    while last.data['next']:
+        last = reader_client.get(last.data['next'])
+    assert last.data['count'] == len(expected)
+    assert walk(reader_client, last.data['previous'], 'previous') == (
+        pages[-2::-1]
+    )
+
+
+@pytest.mark.django_db
+def test_recipe_feed(dataset, reader_client):
+    authors = Subscription.objects.filter(
+        user=dataset.reader
+    ).values('author')
+    expected = list(
+        Recipe.objects.filter(author__in=authors)
+        .order_by('-pub_date', '-id').values_list('id', flat=True)
+    )
+    assert expected
+    pages = walk(reader_client, '/api/recipes/feed/?limit=10', 'next')
+    assert [pk for page in pages for pk in page] == expected
+    response = reader_client.get('/api/recipes/feed/?count=true')
+    assert response.data['count'] == len(expected)
+    assert 'count' not in reader_client.get('/api/recipes/feed/').data
+    tagged = reader_client.get(
+        f'/api/recipes/feed/?tags={dataset.tag.slug}&limit=100'
+    )
+    assert {recipe['id'] for recipe in tagged.data['results']} <= set(
+        expected
+    )
+    assert all(
+        dataset.tag.slug in {tag['slug'] for tag in recipe['tags']}
+        for recipe in tagged.data['results']
+    )
+
+
+@pytest.mark.django_db
+def test_recipe_cursor_is_stable_under_inserts(dataset, reader_client):
+    first = reader_client.get('/api/recipes/?cursor=&count=false')
+    assert 'count' not in first.data
+    Recipe.objects.create(
+        author=dataset.author, name='Свежий рецепт', text='Новый',
+        cooking_time=5, image='recipes/images/new.png'
+    )
+    second = reader_client.get(first.data['next'])
+    first_ids = {recipe['id'] for recipe in first.data['results']}
+    second_ids = {recipe['id'] for recipe in second.data['results']}
+    assert not first_ids & second_ids
+    assert len(second_ids) == 6
+
+
+@pytest.mark.django_db
+def test_recipe_list_count_is_cached(dataset, reader_client):
+    path = f'/api/recipes/?author={dataset.reader.id}'
+    first, cold = measure(reader_client, 'get', path)
+    second, warm = measure(reader_client, 'get', path)
+    assert warm.queries == cold.queries - 1
+    assert not any('COUNT(' in sql for sql in warm.sql)
+    assert second.data['count'] == first.data['count'] == (
+        Recipe.objects.filter(author=dataset.reader).count()
+    )
+    assert second.data['count_is_exact']
+    other = reader_client.get(f'/api/recipes/?author={dataset.author.id}')
+    assert other.data['count'] == (
+        Recipe.objects.filter(author=dataset.author).count()
+    )
+
+    # Число строк не зависит от пользователя, сортировки и ?fields=.
+    token, _ = Token.objects.get_or_create(user=dataset.stranger)
+    stranger = APIClient()
+    stranger.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    for client, variant in (
+        (reader_client, f'{path}&fields=id,name&sort=popular'),
+        (stranger, path),
+    ):
+        response, shared = measure(client, 'get', variant)
+        assert not any('COUNT(' in sql for sql in shared.sql)
+        assert response.data['count'] == first.data['count']
+    favorites, _ = measure(reader_client, 'get', f'{path}&is_favorited=1')
+    assert favorites.data['count'] == Recipe.objects.filter(
+        author=dataset.reader, favorites__user=dataset.reader
+    ).count()
+
+
+@pytest.mark.django_db
+def test_recipe_list_sees_writes_within_count_timeout(
+    dataset, reader_client, anonymous_client,
+    django_capture_on_commit_callbacks
+):
+    path = '/api/recipes/?is_favorited=1&limit=1000'
+    before = reader_client.get(path).data
+    new = Recipe.objects.exclude(favorites__user=dataset.reader).first()
+    reader_client.post(f'/api/recipes/{new.id}/favorite/')
+    after = reader_client.get(path).data
+    assert after['count'] == before['count'] + 1
+    assert new.id in {recipe['id'] for recipe in after['results']}
+
+    path = f'/api/recipes/?author={dataset.author.id}&limit=1000'
+    before = anonymous_client.get(path).data
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe = Recipe.objects.create(
+            author=dataset.author, name='Свежий рецепт', text='Новый',
+            cooking_time=5, image='recipes/images/new.png'
+        )
+    after = anonymous_client.get(path).json()
+    assert after['count'] == before['count'] + 1
+    assert len(after['results']) == after['count']
+    assert after['results'][0]['id'] == recipe.id
+
+
+@pytest.mark.django_db
+def test_page_does_not_stop_at_cached_count(dataset, reader_client):
+    path = '/api/users/?limit=100'
+    count = reader_client.get(path).data['count']
+    user = User.objects.create_user(
+        username='latecomer', email='latecomer@example.com',
+        first_name='Поздний', last_name='Пользователь', password='x'
+    )
+    page = reader_client.get(f'{path}&page={count // 100 + 1}').data
+    assert page['count'] == count
+    assert page['results'][-1]['id'] == user.id
+
+
+TAG_SLUGS = ('breakfast', 'lunch', 'dinner', 'dessert', 'snack')
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('mode', ['any', 'all'])
+def test_tag_filter_cost_is_flat(mode, dataset, reader_client):
+    queries, seconds = [], []
+    for number in range(1, len(TAG_SLUGS) + 1):
+        tags = '&'.join(f'tags={slug}' for slug in TAG_SLUGS[:number])
+        # Лучшее из трёх прогонов, чтобы случайная пауза не портила замер.
+        runs = []
+        for _ in range(3):
+            caches['default'].clear()
+            response, measurement = measure(
+                reader_client, 'get', f'/api/recipes/?{tags}&tags_mode={mode}'
+            )
+            assert response.status_code == 200
+            assert not any('DISTINCT' in sql for sql in measurement.sql)
+            runs.append(measurement)
+        queries.append(runs[0].queries)
+        seconds.append(min(run.seconds for run in runs))
+    # Пустая страница обходится без prefetch, поэтому запросов может
+    # стать меньше, но не больше.
+    assert max(queries) == queries[0], queries
+    assert max(seconds) < min(seconds) * 3 + 0.05, seconds
+
+
+@pytest.mark.django_db
+def test_tag_filter_modes(dataset, reader_client):
+    slugs = TAG_SLUGS[:2]
+    tags = '&'.join(f'tags={slug}' for slug in slugs)
+    both = Recipe.objects.filter(tags__slug=slugs[0]).filter(
+        tags__slug=slugs[1]
+    )
+    either = Recipe.objects.filter(tags__slug__in=slugs).distinct()
+    response = reader_client.get(f'/api/recipes/?{tags}&tags_mode=all')
+    assert response.data['count'] == both.count()
+    response = reader_client.get(f'/api/recipes/?{tags}&limit=100')
+    assert response.data['count'] == either.count()
+    ids = [recipe['id'] for recipe in response.data['results']]
+    assert len(ids) == len(set(ids))
+    response = reader_client.get('/api/recipes/?tags_mode=some')
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_recipe_update_touches_only_changed_rows(
+    dataset, reader_client, caplog
+):
+    path = f'/api/recipes/{dataset.own_recipe.id}/'
+    payload = recipe_payload(dataset, 'Рецепт для правки')
+    reader_client.patch(path, data=payload, format='json')
+    rows = dict(
+        RecipeIngredients.objects.filter(
+            recipe=dataset.own_recipe
+        ).values_list('ingredient_id', 'id')
+    )
+    payload['ingredients'][0]['amount'] = 25
+    with caplog.at_level(logging.DEBUG, logger='api.serializers'):
+        response, measurement = measure(
+            reader_client, 'patch', path, data=payload
+        )
+    assert response.status_code == 200
+    assert caplog.messages[-1] == (
+        f'Рецепт {dataset.own_recipe.id}: изменено строк ингредиентов: 1'
+    )
+    writes = [
+        sql for sql in measurement.sql
+        if 'recipes_recipeingredients' in sql.split(' WHERE ')[0]
+        and not sql.startswith('SELECT')
+    ]
+    assert len(writes) == 1 and writes[0].startswith('UPDATE'), writes
+    assert dict(
+        RecipeIngredients.objects.filter(
+            recipe=dataset.own_recipe
+        ).values_list('ingredient_id', 'id')
+    ) == rows
+    amounts = {
+        ingredient['id']: ingredient['amount']
+        for ingredient in response.data['ingredients']
+    }
+    assert amounts[payload['ingredients'][0]['id']] == 25
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('action', ['favorite', 'shopping_cart'])
+def test_recipe_toggle_status_codes(action, dataset, reader_client):
+    path = f'/api/recipes/{dataset.free_recipe.id}/{action}/'
+    response = reader_client.post(path)
+    assert response.status_code == 201
+    assert response.data['id'] == dataset.free_recipe.id
+    assert reader_client.post(path).status_code == 400
+    assert reader_client.delete(path).status_code == 204
+    assert reader_client.delete(path).status_code == 400
+    missing = Recipe.objects.order_by('-id').first().id + 1
+    assert reader_client.post(
+        f'/api/recipes/{missing}/{action}/'
+    ).status_code == 404
+    assert reader_client.delete(
+        f'/api/recipes/{missing}/{action}/'
+    ).status_code == 404
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('action, model, present', [
+    ('favorite', Favorite, 'favorite_recipe'),
+    ('shopping_cart', ShoppingCart, 'cart_recipe'),
+])
+def test_bulk_recipe_actions(action, model, present, dataset, reader_client):
+    missing = Recipe.objects.order_by('-id').first().id + 1
+    ids = [
+        dataset.free_recipe.id, dataset.favorite_recipe.id,
+        dataset.cart_recipe.id, missing, dataset.free_recipe.id,
+    ]
+    present = getattr(dataset, present).id
+    response = reader_client.post(
+        f'/api/recipes/{action}/', data={'ids': ids}, format='json'
+    )
+    assert response.status_code == 200
+    statuses = {row['id']: row['status'] for row in response.data['results']}
+    assert len(response.data['results']) == 4
+    assert statuses[missing] == 'not_found'
+    assert statuses[present] == 'exists'
+    assert statuses[dataset.free_recipe.id] == 'added'
+    assert model.objects.filter(
+        user=dataset.reader, recipe_id__in=ids
+    ).count() == 3
+    call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+
+    response = reader_client.delete(
+        f'/api/recipes/{action}/',
+        data={'ids': [dataset.free_recipe.id, missing]}, format='json'
+    )
+    assert [row['status'] for row in response.data['results']] == [
+        'removed', 'not_found'
+    ]
+    assert not model.objects.filter(
+        user=dataset.reader, recipe=dataset.free_recipe
+    ).exists()
+    call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+    assert reader_client.post(
+        f'/api/recipes/{action}/', data={'ids': []}, format='json'
+    ).status_code == 400
+
+
+@pytest.mark.django_db
+def test_bulk_cart_add_recovers_from_race(dataset, monkeypatch):
+    # Параллельный запрос успел добавить рецепт между проверкой и INSERT.
+    monkeypatch.setattr(
+        type(ShoppingCart.objects.all()), 'present',
+        lambda self, user_id, recipe_ids: set()
+    )
+    added = ShoppingCart.objects.add_recipes(
+        dataset.reader.id, [dataset.cart_recipe.id, dataset.free_recipe.id]
+    )
+    assert added == [dataset.cart_recipe.id, dataset.free_recipe.id]
+    call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_counters_follow_recipe_create_and_delete(dataset, reader_client):
+    response = reader_client.post(
+        '/api/recipes/', data=recipe_payload(dataset, 'Счётчики'),
+        format='json'
+    )
+    assert response.status_code == 201
+    recipe_id = response.data['id']
+    for action in ('favorite', 'shopping_cart'):
+        reader_client.post(f'/api/recipes/{recipe_id}/{action}/')
+    recipe = Recipe.objects.get(pk=recipe_id)
+    assert (recipe.favorites_count, recipe.in_carts_count) == (1, 1)
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+    assert reader_client.delete(
+        f'/api/recipes/{dataset.own_recipe.id}/'
+    ).status_code == 204
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_stale_save_keeps_counters(dataset):
+    recipe = Recipe.objects.get(pk=dataset.free_recipe.id)
+    author = User.objects.get(pk=dataset.stranger.id)
+    # Пока объекты загружены, счётчики меняются в других запросах.
+    Favorite.objects.create(user=dataset.reader, recipe=recipe)
+    Subscription.objects.create(user=dataset.reader, author=author)
+    recipe.name = 'Переименованный рецепт'
+    recipe.save()
+    author.first_name = 'Переименованный'
+    author.save()
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+    assert Recipe.objects.get(pk=recipe.pk).name == recipe.name
+    assert User.objects.get(pk=author.pk).first_name == author.first_name
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('sort, field', [
+    ('popular', 'favorites_count'),
+    ('in_carts', 'in_carts_count'),
+])
+def test_recipe_sort_by_counter(sort, field, dataset, reader_client):
+    response = reader_client.get(f'/api/recipes/?sort={sort}&limit=20')
+    assert response.status_code == 200
+    counts = dict(Recipe.objects.values_list('id', field))
+    values = [counts[recipe['id']] for recipe in response.data['results']]
+    assert values == sorted(values, reverse=True)
+    assert values[0] == max(counts.values())
+    # Курсор строится по той же сортировке, что и страница.
+    pages = walk(
+        reader_client,
+        f'/api/recipes/?sort={sort}&cursor=&limit=7'
+        f'&author={dataset.reader.id}',
+        'next'
+    )
+    ids = [pk for page in pages for pk in page]
+    assert ids == list(
+        Recipe.objects.filter(author=dataset.reader).order_by(
+            f'-{field}', '-pub_date', '-id'
+        ).values_list('id', flat=True)
+    )
+
+
+@pytest.mark.django_db
+def test_trending_scores(dataset, reader_client):
+    now = timezone.now()
+    # Всё, что старше окна, не учитывается вовсе.
+    for model in (Favorite, ShoppingCart):
+        model.objects.update(created=now - timedelta(days=60))
+    fresh, stale, other = Recipe.objects.order_by('id')[:3]
+    users = list(User.objects.order_by('id')[:2])
+    for user in users:
+        Favorite.objects.get_or_create(user=user, recipe=stale)
+    ShoppingCart.objects.get_or_create(user=users[0], recipe=fresh)
+    ShoppingCart.objects.filter(recipe=fresh).update(created=now)
+    # Два добавления трёхдневной давности весят меньше одного свежего.
+    Favorite.objects.filter(recipe=stale).update(
+        created=now - timedelta(days=3)
+    )
+    out = StringIO()
+    call_command('compute_recipe_scores', '--half-life=24', stdout=out)
+    assert 'ненулевым рейтингом: 2' in out.getvalue()
+    fresh.refresh_from_db()
+    stale.refresh_from_db()
+    assert fresh.trending_score > stale.trending_score > 0
+    response = reader_client.get('/api/recipes/?sort=trending&limit=3')
+    assert [recipe['id'] for recipe in response.data['results']][:2] == [
+        fresh.id, stale.id
+    ]
+    assert Recipe.objects.get(pk=other.pk).trending_score == 0
+    with pytest.raises(CommandError):
+        call_command('compute_recipe_scores', '--window=0')
+
+
+@pytest.mark.django_db
+def test_reconcile_counters(dataset):
+    Recipe.objects.filter(pk=dataset.recipe.id).update(favorites_count=999)
+    with pytest.raises(CommandError):
+        call_command('reconcile_counters', '--verify', stdout=StringIO())
+    out = StringIO()
+    call_command('reconcile_counters', stdout=out)
+    assert 'исправлены: 1' in out.getvalue()
+    assert Recipe.objects.get(
+        pk=dataset.recipe.id
+    ).favorites_count == Favorite.objects.filter(
+        recipe=dataset.recipe
+    ).count()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('reader', (True, False))
+def test_sparse_fields(reader, dataset, reader_client, monkeypatch):
+    if not reader:
+        monkeypatch.setattr(RecipeViewSet, 'reader_class', None)
+    response, measurement = measure(
+        reader_client, 'get', f'/api/recipes/?fields={CARD_FIELDS}'
+    )
+    recipe = response.data['results'][0]
+    # Поля идут в обычном порядке ответа, а не в порядке из запроса.
+    assert list(recipe) == [
+        name for name in RECIPE_FIELDS if name in CARD_FIELDS.split(',')
+    ]
+    assert set(recipe['author']) == {
+        'email', 'id', 'username', 'first_name', 'last_name', 'is_subscribed'
+    }
+    assert recipe['tags'] and set(recipe['tags'][0]) == {
+        'id', 'name', 'color', 'slug'
+    }
+    page = next(sql for sql in measurement.sql if 'LIMIT' in sql)
+    assert '"text"' not in page and 'EXISTS' not in page
+
+    response = reader_client.get(
+        f'/api/recipes/{dataset.favorite_recipe.id}/'
+        '?omit=text,ingredients,author'
+    )
+    assert 'text' not in response.data and 'ingredients' not in response.data
+    assert response.data['is_favorited'] is True
+    response = reader_client.get(
+        '/api/recipes/feed/?fields=id,name&omit=name'
+    )
+    assert all(list(row) == ['id'] for row in response.data['results'])
+
+    # Курсор строится по полям сортировки, даже если их нет в ответе.
+    first = reader_client.get(
+        '/api/recipes/?sort=popular&cursor=&fields=id&limit=3'
+    )
+    second = reader_client.get(first.data['next'])
+    assert len(second.data['results']) == 3
+    assert not {row['id'] for row in first.data['results']} & {
+        row['id'] for row in second.data['results']
+    }
+
+    for query in ('fields=id,unknown', 'omit=' + ','.join(RECIPE_FIELDS)):
+        response = reader_client.get(f'/api/recipes/?{query}')
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_recipe_response_has_no_internal_columns(dataset, anonymous_client):
+    # Счётчики и рейтинг меняются без смены ETag, поэтому в ответ не идут.
+    recipe = anonymous_client.get(f'/api/recipes/{dataset.recipe.id}/').data
+    assert list(recipe) == list(RECIPE_FIELDS)
+    assert not {
+        'updated_at', 'favorites_count', 'in_carts_count', 'trending_score',
+        'image_variants',
+    } & set(recipe)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('client_name', ('anonymous_client', 'reader_client'))
+def test_recipe_detail_invalid_id(client_name, request):
+    client = request.getfixturevalue(client_name)
+    assert client.get('/api/recipes/abc/').status_code == 404
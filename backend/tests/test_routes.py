@@ -0,0 +1,20 @@
+from djoser.urls import authtoken
+
+from recipes.urls import router as recipes_router
+from users.urls import router as users_router
+from .test_recipes import SCENARIOS as RECIPES_SCENARIOS
+from .test_users import SCENARIOS as USERS_SCENARIOS
+
+
+def test_every_route_has_benchmark():
+    routes = {
+        url.name
+        for urls in (
+            recipes_router.urls, users_router.urls, authtoken.urlpatterns
+        )
+        for url in urls
+    }
+    covered = {
+        scenario.route for scenario in RECIPES_SCENARIOS + USERS_SCENARIOS
+    }
+    assert routes <= covered, sorted(routes - covered)
@@ -0,0 +1,39 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from recipes.models import ShoppingCart
+from .test_recipes import recipe_payload
+
+
+def verify_shopping_lists():
+    call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_shopping_list_follows_cart(dataset, reader_client):
+    verify_shopping_lists()
+    reader_client.post(f'/api/recipes/{dataset.free_recipe.id}/shopping_cart/')
+    verify_shopping_lists()
+    reader_client.delete(
+        f'/api/recipes/{dataset.cart_recipe.id}/shopping_cart/'
+    )
+    verify_shopping_lists()
+
+
+@pytest.mark.django_db
+def test_shopping_list_follows_recipe_changes(dataset, reader_client):
+    recipe = dataset.own_recipe
+    ShoppingCart.objects.create(user=dataset.reader, recipe=recipe)
+    ShoppingCart.objects.create(user=dataset.author, recipe=recipe)
+    verify_shopping_lists()
+    response = reader_client.patch(
+        f'/api/recipes/{recipe.id}/',
+        data=recipe_payload(dataset, 'Изменённый рецепт'),
+        format='json'
+    )
+    assert response.status_code == 200
+    verify_shopping_lists()
+    reader_client.delete(f'/api/recipes/{recipe.id}/')
+    verify_shopping_lists()
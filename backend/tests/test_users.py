@@ -0,0 +1,206 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from users.models import Subscription
+
+from .benchmark import Budget, Scenario, measure, run_scenario
+
+
+SCENARIOS = [
+    Scenario(
+        'users-list-anonymous', 'users-list', 'get',
+        lambda d: '/api/users/', 200, Budget(queries=2), auth=False
+    ),
+    Scenario(
+        'users-list', 'users-list', 'get',
+        lambda d: '/api/users/', 200, Budget(queries=3)
+    ),
+    Scenario(
+        'users-create', 'users-list', 'post',
+        lambda d: '/api/users/', 201, Budget(queries=5, memory_kb=8192),
+        data=lambda d: {
+            'email': 'new@foodgram.ru',
+            'username': 'new_user',
+            'first_name': 'Новый',
+            'last_name': 'Пользователь',
+            'password': 'Sup3r-secret!',
+        },
+        auth=False
+    ),
+    Scenario(
+        'users-detail', 'users-detail', 'get',
+        lambda d: f'/api/users/{d.author.id}/', 200, Budget(queries=2)
+    ),
+    Scenario(
+        'users-me', 'users-me', 'get',
+        lambda d: '/api/users/me/', 200, Budget(queries=2)
+    ),
+    Scenario(
+        'users-subscriptions', 'users-subscriptions', 'get',
+        lambda d: '/api/users/subscriptions/', 200, Budget(queries=4)
+    ),
+    Scenario(
+        'users-subscriptions-recipes-limit', 'users-subscriptions', 'get',
+        lambda d: '/api/users/subscriptions/?limit=100&recipes_limit=3',
+        200, Budget(queries=4, memory_kb=8192)
+    ),
+    Scenario(
+        'users-subscriptions-without-recipes', 'users-subscriptions', 'get',
+        lambda d: '/api/users/subscriptions/?omit=recipes', 200,
+        Budget(queries=3)
+    ),
+    Scenario(
+        'users-subscriptions-cursor', 'users-subscriptions', 'get',
+        lambda d: '/api/users/subscriptions/?cursor=&count=false', 200,
+        Budget(queries=3)
+    ),
+    Scenario(
+        'users-subscriptions-invalid-recipes-limit', 'users-subscriptions',
+        'get', lambda d: '/api/users/subscriptions/?recipes_limit=-1', 400,
+        Budget(queries=3)
+    ),
+    Scenario(
+        'users-subscribe', 'users-subscribe', 'post',
+        lambda d: f'/api/users/{d.stranger.id}/subscribe/', 201,
+        Budget(queries=7)
+    ),
+    Scenario(
+        'users-subscribe-bulk', 'users-subscribe-bulk', 'post',
+        lambda d: '/api/users/subscribe/', 200, Budget(queries=8),
+        data=lambda d: {'ids': [d.stranger.id, d.author.id, d.reader.id]}
+    ),
+    Scenario(
+        'users-unsubscribe-bulk', 'users-subscribe-bulk', 'delete',
+        lambda d: '/api/users/subscribe/', 200, Budget(queries=8),
+        data=lambda d: {'ids': [d.stranger.id, d.author.id, d.reader.id]}
+    ),
+    Scenario(
+        'users-unsubscribe', 'users-subscribe', 'delete',
+        lambda d: f'/api/users/{d.author.id}/subscribe/', 204,
+        Budget(queries=6)
+    ),
+    Scenario(
+        'users-set-password', 'users-set-password', 'post',
+        lambda d: '/api/users/set_password/', 204, Budget(queries=3),
+        data=lambda d: {
+            'current_password': d.password,
+            'new_password': 'N3w-secret-password',
+        }
+    ),
+    Scenario(
+        'users-activation', 'users-activation', 'post',
+        lambda d: '/api/users/activation/', 400, Budget(queries=0),
+        data=lambda d: {'uid': 'invalid', 'token': 'invalid'},
+        auth=False
+    ),
+    Scenario(
+        'users-resend-activation', 'users-resend-activation', 'post',
+        lambda d: '/api/users/resend_activation/', 400, Budget(queries=1),
+        data=lambda d: {'email': d.reader.email},
+        auth=False
+    ),
+    Scenario(
+        'users-reset-password', 'users-reset-password', 'post',
+        lambda d: '/api/users/reset_password/', 400, Budget(queries=1),
+        data=lambda d: {'email': d.reader.email},
+        auth=False
+    ),
+    Scenario(
+        'users-reset-password-confirm', 'users-reset-password-confirm',
+        'post', lambda d: '/api/users/reset_password_confirm/', 400,
+        Budget(queries=0),
+        data=lambda d: {
+            'uid': 'invalid', 'token': 'invalid', 'new_password': 'x'
+        },
+        auth=False
+    ),
+    Scenario(
+        'users-reset-username', 'users-reset-username', 'post',
+        lambda d: '/api/users/reset_email/', 400, Budget(queries=1),
+        data=lambda d: {'email': d.reader.email},
+        auth=False
+    ),
+    Scenario(
+        'users-reset-username-confirm', 'users-reset-username-confirm',
+        'post', lambda d: '/api/users/reset_email_confirm/', 400,
+        Budget(queries=0),
+        data=lambda d: {'uid': 'invalid', 'token': 'invalid'},
+        auth=False
+    ),
+    Scenario(
+        'users-set-username', 'users-set-username', 'post',
+        lambda d: '/api/users/set_email/', 400, Budget(queries=1),
+        data=lambda d: {
+            'current_password': d.password,
+            'new_email': 'renamed@foodgram.ru',
+        }
+    ),
+    Scenario(
+        'login', 'login', 'post',
+        lambda d: '/api/auth/token/login/', 200, Budget(queries=4),
+        data=lambda d: {'email': d.reader.email, 'password': d.password},
+        auth=False
+    ),
+    Scenario(
+        'logout', 'logout', 'post',
+        lambda d: '/api/auth/token/logout/', 204, Budget(queries=2)
+    ),
+]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('scenario', SCENARIOS, ids=str)
+def test_users_budget(scenario, dataset, anonymous_client, reader_client):
+    run_scenario(scenario, dataset, anonymous_client, reader_client)
+
+
+@pytest.mark.django_db
+def test_bulk_subscribe(dataset, reader_client):
+    ids = [dataset.stranger.id, dataset.author.id, dataset.reader.id, 10**9]
+    response = reader_client.post(
+        '/api/users/subscribe/', data={'ids': ids}, format='json'
+    )
+    assert response.status_code == 200
+    assert [row['status'] for row in response.data['results']] == [
+        'subscribed', 'exists', 'self', 'not_found'
+    ]
+    assert Subscription.objects.filter(
+        user=dataset.reader, author=dataset.stranger
+    ).exists()
+    response = reader_client.delete(
+        '/api/users/subscribe/', data={'ids': ids}, format='json'
+    )
+    assert [row['status'] for row in response.data['results']] == [
+        'unsubscribed', 'unsubscribed', 'absent', 'not_found'
+    ]
+    assert not Subscription.objects.filter(
+        user=dataset.reader, author_id__in=ids
+    ).exists()
+    call_command('reconcile_counters', '--verify', stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_users_sparse_fields(dataset, reader_client):
+    response, measurement = measure(
+        reader_client, 'get', '/api/users/?fields=username,id'
+    )
+    assert list(response.data['results'][0]) == ['id', 'username']
+    page = measurement.sql[-1]
+    assert 'EXISTS' not in page and '"email"' not in page
+
+    response = reader_client.get(
+        f'/api/users/{dataset.author.id}/?omit=email'
+    )
+    assert 'email' not in response.data
+    assert response.data['is_subscribed'] is True
+    response = reader_client.get('/api/users/me/?fields=id')
+    assert response.data == {'id': dataset.reader.id}
+
+    response = reader_client.get(
+        '/api/users/subscriptions/?fields=id,recipes_count'
+    )
+    assert list(response.data['results'][0]) == ['id', 'recipes_count']
+    response = reader_client.get('/api/users/?fields=recipes')
+    assert response.status_code == 400
@@ -1,5 +1,19 @@
+from django.apps import apps
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import UserManager as BaseUserManager
+from django.db import connections, models, transaction
+from django.db.models import (
+    BooleanField,
+    Count,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value
+)
+from django.db.models.functions import Coalesce
 
 from django.core.validators import EmailValidator
 
@@ -19,8 +33,120 @@ ROLE_CHOICES = [
 ]
 
 
-class User(AbstractUser):
+def related_count(model, field):
+    '''Число строк ``model``, ссылающихся полем ``field`` на текущую
+    запись, — для пересчёта счётчиков одним UPDATE.'''
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+class CounterQuerySet(models.QuerySet):
+    '''Денормализованные счётчики: сдвиг через F() и сверка с таблицами.
+
+    Наследники задают ``counters`` — {поле счётчика: (модель, поле
+    ссылки)}.
+    '''
+    counters = {}
+
+    def increment(self, field, delta=1):
+        if delta < 0:
+            # Счётчик не уходит в минус, даже если успел разойтись.
+            return self.filter(**{f'{field}__gte': -delta}).update(
+                **{field: F(field) + delta}
+            )
+        return self.update(**{field: F(field) + delta})
+
+    def get_counters(self):
+        return {
+            field: related_count(apps.get_model(model), related)
+            for field, (model, related) in self.counters.items()
+        }
+
+    def recount(self, *fields):
+        counters = self.get_counters()
+        return self.update(**{
+            field: value for field, value in counters.items()
+            if not fields or field in fields
+        })
+
+    def stale_counters(self):
+        '''Записи, у которых хотя бы один счётчик разошёлся с таблицами.'''
+        condition = Q()
+        for field in self.counters:
+            condition |= ~Q(**{field: F(f'actual_{field}')})
+        return self.annotate(**{
+            f'actual_{field}': value
+            for field, value in self.get_counters().items()
+        }).filter(condition)
+
+
+class CounterModel(models.Model):
+    '''Модель с денормализованными полями ``counter_fields``.
+
+    Сохранение существующей записи эти поля не пишет: их меняют только
+    UPDATE с F() и пересчёт, а значения, прочитанные в начале запроса,
+    затёрли бы сделанные с тех пор изменения. Записать их можно, явно
+    перечислив в ``update_fields``.
+    '''
+    counter_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if update_fields is None and not (
+            force_insert or self._state.adding
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class UserQuerySet(CounterQuerySet):
+    counters = {
+        'recipes_count': ('recipes.Recipe', 'author'),
+        'followers_count': ('users.Subscription', 'author'),
+    }
+
+    def with_is_subscribed(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(
+                Subscription.objects.filter(user=user, author=OuterRef('pk'))
+            )
+        )
+
+    def subscriptions_of(self, user):
+        return self.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).order_by('id')
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
+
+
+class User(CounterModel, AbstractUser):
     USERNAME_FIELD = 'email'
+    counter_fields = ('recipes_count', 'followers_count')
 
     REQUIRED_FIELDS = [
         'username',
@@ -64,6 +190,20 @@ class User(AbstractUser):
         blank=True
     )
 
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False
+    )
+
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Число подписчиков',
+        default=0,
+        editable=False
+    )
+
+    objects = UserManager()
+
     class Meta:
         ordering = ['id']
         verbose_name = 'Пользователь'
@@ -81,6 +221,33 @@ class User(AbstractUser):
         return self.role == ADMIN or self.is_superuser or self.is_staff
 
 
+class SubscriptionQuerySet(models.QuerySet):
+    # Пакетные подписки идут мимо сигналов, поэтому счётчики подписчиков
+    # авторов пересчитываются здесь одним UPDATE.
+
+    @transaction.atomic
+    def subscribe(self, user, author_ids):
+        self.bulk_create(
+            [self.model(user=user, author_id=pk) for pk in author_ids],
+            ignore_conflicts=True
+        )
+        User.objects.filter(pk__in=author_ids).recount('followers_count')
+
+    @transaction.atomic
+    def unsubscribe(self, user, author_ids):
+        if not author_ids:
+            return
+        ops = connections[self.db].ops
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {ops.quote_name(self.model._meta.db_table)} '
+                f'WHERE user_id = %s AND author_id IN ('
+                + ', '.join(['%s'] * len(author_ids)) + ')',
+                [user.id, *author_ids]
+            )
+        User.objects.filter(pk__in=author_ids).recount('followers_count')
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(
         User,
@@ -95,6 +262,8 @@ class Subscription(models.Model):
         verbose_name='Автор',
     )
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -104,3 +273,8 @@ class Subscription(models.Model):
                 name='unique_subscription'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='subscription_author_user_idx'
+            ),
+        ]
@@ -4,17 +4,20 @@ from djoser.serializers import (
 )
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from rest_framework.fields import SerializerMethodField
-from rest_framework.serializers import ModelSerializer
+from rest_framework.fields import IntegerField, SerializerMethodField
+from rest_framework.serializers import ListSerializer, ModelSerializer
 
+from api.fields import ImageVariantsField, SparseFieldsSerializerMixin
 from recipes.models import Recipe
 from .models import Subscription, User
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(SparseFieldsSerializerMixin, UserSerializer):
     is_subscribed = SerializerMethodField(read_only=True)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
@@ -38,13 +41,31 @@ class CustomUserCreateSerializer(UserCreateSerializer):
 
 
 class RecipeSubscribeSerializer(ModelSerializer):
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
+
+
+def set_recipes_preview(authors, limit):
+    recipes = {author.id: [] for author in authors}
+    for recipe in Recipe.objects.latest_by_authors(authors, limit):
+        recipes[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipes_preview = recipes[author.id]
+
+
+class SubscribeListSerializer(ListSerializer):
+    def to_representation(self, data):
+        authors = list(data)
+        if 'recipes' in self.child.fields:
+            set_recipes_preview(authors, self.child.get_recipes_limit())
+        return super().to_representation(authors)
 
 
 class SubscribeSerializer(CustomUserSerializer):
-    recipes_count = SerializerMethodField()
+    recipes_count = IntegerField(read_only=True)
     recipes = SerializerMethodField()
 
     def validate(self, data):
@@ -60,28 +81,28 @@ class SubscribeSerializer(CustomUserSerializer):
                 detail='вы не можете подписываться на самого себя',
                 code=status.HTTP_400_BAD_REQUEST
             )
+        self.get_recipes_limit()
         return data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    def get_recipes_limit(self):
+        limit = self.context['request'].query_params.get('recipes_limit')
+        if limit is None:
+            return None
+        try:
+            return IntegerField(min_value=0).run_validation(limit)
+        except ValidationError as error:
+            raise ValidationError({'recipes_limit': error.detail})
 
     def get_recipes(self, obj):
-        limit = (
-            self.context['request'].query_params.get('recipes_limit')
-        )
-        recipes = obj.recipes.all()
-
-        if limit is not None:
-            limit = int(limit)
-            serializer = RecipeSubscribeSerializer(
-                recipes[:limit], many=True
-            )
-        else:
-            serializer = RecipeSubscribeSerializer(recipes, many=True)
-        return serializer.data
+        if not hasattr(obj, 'recipes_preview'):
+            set_recipes_preview([obj], self.get_recipes_limit())
+        return RecipeSubscribeSerializer(
+            obj.recipes_preview, many=True
+        ).data
 
     class Meta(CustomUserSerializer.Meta):
         fields = CustomUserSerializer.Meta.fields + (
             'recipes_count', 'recipes'
         )
         read_only_fields = ('email', 'username', 'first_name', 'last_name',)
+        list_serializer_class = SubscribeListSerializer
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Subscription, User
+
+
+@receiver(post_save, sender=Subscription)
+def count_added_follower(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).increment(
+            'followers_count'
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def count_removed_follower(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).increment(
+        'followers_count', -1
+    )
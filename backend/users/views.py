@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from djoser.serializers import SetPasswordSerializer
 from djoser.views import UserViewSet
@@ -6,6 +7,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from .models import Subscription, User
+from api.mixins import BulkActionMixin, SparseFieldsMixin
 from .serializers import (
     CustomUserCreateSerializer,
     CustomUserSerializer,
@@ -13,8 +15,38 @@ from .serializers import (
 )
 
 
-class UsersViewSet(UserViewSet):
+# Поля ответа, которые хранятся в столбцах таблицы пользователей.
+USER_COLUMNS = (
+    'email', 'id', 'username', 'first_name', 'last_name', 'recipes_count',
+)
+
+
+class UsersViewSet(SparseFieldsMixin, BulkActionMixin, UserViewSet):
     queryset = User.objects.all()
+    cursor_ordering = ('id',)
+
+    def get_sparse_fields(self):
+        if self.action == 'subscriptions':
+            return SubscribeSerializer.Meta.fields
+        return CustomUserSerializer.Meta.fields
+
+    def get_count_version(self):
+        # Подписки одного пользователя меняются без сброса кэша.
+        return None if self.action == 'subscriptions' else ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.select_fields(('is_subscribed',)):
+            queryset = queryset.with_is_subscribed(self.request.user)
+        return self.only_requested(queryset)
+
+    def only_requested(self, queryset):
+        fields = self.get_requested_fields()
+        if fields is None:
+            return queryset
+        return queryset.only(*(
+            name for name in fields if name in USER_COLUMNS
+        ))
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -59,18 +91,57 @@ class UsersViewSet(UserViewSet):
         subscription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe',
+        url_name='subscribe-bulk',
+        permission_classes=[permissions.IsAuthenticated, ]
+    )
+    @transaction.atomic
+    def subscribe_bulk(self, request):
+        ids = self.get_bulk_ids(request)
+        # Как и у рецептов: найденных авторов не удалят, пока идёт запись.
+        subscribed = dict(
+            User.objects.filter(pk__in=ids).with_is_subscribed(
+                request.user
+            ).select_for_update(no_key=True).order_by('pk').values_list(
+                'pk', 'is_subscribed'
+            )
+        )
+        if request.method == 'DELETE':
+            Subscription.objects.unsubscribe(
+                request.user, [pk for pk in subscribed if subscribed[pk]]
+            )
+            return self.bulk_response(ids, {
+                pk: 'unsubscribed' if is_subscribed else 'absent'
+                for pk, is_subscribed in subscribed.items()
+            })
+        statuses = {
+            pk: 'exists' if is_subscribed else 'subscribed'
+            for pk, is_subscribed in subscribed.items()
+        }
+        if request.user.id in statuses:
+            statuses[request.user.id] = 'self'
+        Subscription.objects.subscribe(request.user, [
+            pk for pk, status_name in statuses.items()
+            if status_name == 'subscribed'
+        ])
+        return self.bulk_response(ids, statuses)
+
     @action(
         detail=False,
         permission_classes=[permissions.IsAuthenticated, ]
     )
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(following__user=user)
+        queryset = self.only_requested(
+            User.objects.subscriptions_of(request.user)
+        )
         pages = self.paginate_queryset(queryset)
 
         serializer = SubscribeSerializer(
             pages,
             many=True,
-            context={'request': request}
+            context=self.get_serializer_context()
         )
         return self.get_paginated_response(serializer.data)